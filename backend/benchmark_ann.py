@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Recall vs. latency benchmark for the IVF index behind MemoryVectorDB.search
+
+Usage:
+    python benchmark_ann.py --rows 200000 --dimension 768 --n-probe 1 4 8 16 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ivf_index import IVFIndex
+from memory_vectordb import MemoryVectorDB
+
+def make_clustered_vectors(rows: int, dimension: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Synthetic embeddings grouped around random centres, similar to families of BOM parts"""
+    centres = rng.normal(0, 1, (clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    return centres[labels] + rng.normal(0, 0.6, (rows, dimension)).astype(np.float32)
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    vectors = make_clustered_vectors(args.rows, args.dimension, args.clusters, rng)
+    queries = make_clustered_vectors(args.queries, args.dimension, args.clusters, rng)
+
+    index = IVFIndex(n_lists=args.n_lists, min_train_size=args.rows)
+    db = MemoryVectorDB(precision=args.precision, ann_index=index)
+
+    start = time.perf_counter()
+    for vector in vectors:
+        db.add_document_with_embedding("", {}, vector)
+    print(f"Inserted {args.rows} x {args.dimension} vectors ({args.precision}) "
+          f"and trained {index.get_stats()['n_lists']} lists in {time.perf_counter() - start:.1f}s")
+
+    def timed_search(**kwargs):
+        hits, elapsed = [], 0.0
+        for query in queries:
+            t0 = time.perf_counter()
+            result = db.search_by_vector(query, args.k, -1.0, **kwargs)
+            elapsed += time.perf_counter() - t0
+            hits.append({row for row, _ in result})
+        return hits, elapsed / len(queries) * 1000
+
+    exact_hits, exact_ms = timed_search(exact=True)
+    print(f"{'n_probe':>8} {'recall@' + str(args.k):>10} {'ms/query':>10} {'speedup':>8}")
+    print(f"{'exact':>8} {1.0:>10.3f} {exact_ms:>10.2f} {1.0:>8.1f}")
+    for n_probe in args.n_probe:
+        ann_hits, ann_ms = timed_search(n_probe=n_probe)
+        recall = np.mean([len(a & e) / max(len(e), 1) for a, e in zip(ann_hits, exact_hits)])
+        print(f"{n_probe:>8} {recall:>10.3f} {ann_ms:>10.2f} {exact_ms / ann_ms:>8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark IVF recall against exact search")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--precision", choices=list(MemoryVectorDB.PRECISIONS), default="float32")
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())
@@ -0,0 +1,226 @@
+"""
+BOM parsing and comparison jobs run by the parse worker pool
+Each job takes a file spooled to disk or a serialized parse result and returns a compact
+result (ready-to-send JSON bytes, serialized parses or value tuples) so little has to
+cross the process boundary
+"""
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import zipfile
+from typing import Any, BinaryIO, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from bom_parser import read_file, split_chunks
+from bom_store import BomStore
+from bom_table import BomTable, ParsedBom, diff_tables, parse_bom_document
+from refdes import compress
+
+logger = logging.getLogger(__name__)
+
+# Bytes copied at a time when extracting archive members
+MEMBER_CHUNK_SIZE = 1 << 20
+
+def json_bytes(data: Any) -> bytes:
+    """Encode a response body the way FastAPI's JSONResponse does"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def _grouped_parts(table: BomTable, rows: Iterable[int]) -> List[Dict[str, str]]:
+    """Parts in the /compare-bom layout, one per distinct set of values with REFDES compressed"""
+    groups: Dict[Tuple[int, ...], List[int]] = {}
+    for row in rows:
+        groups.setdefault(table.codes(row), []).append(row)
+    parts = []
+    for members in groups.values():
+        part = table.formatted(members[0])
+        part["REFDES"] = compress([table.refdes[row] for row in members])
+        parts.append(part)
+    return parts
+
+def _grouped_changes(old: BomTable, new: BomTable, old_rows: Iterable[int],
+                     new_rows: Iterable[int]) -> List[Dict[str, Any]]:
+    """Changed parts, one per identical (original, modified) pair with REFDES compressed"""
+    groups: Dict[Tuple[Tuple[int, ...], Tuple[int, ...]], List[Tuple[int, int]]] = {}
+    for old_row, new_row in zip(old_rows, new_rows):
+        groups.setdefault((old.codes(old_row), new.codes(new_row)), []).append((old_row, new_row))
+    changes = []
+    for members in groups.values():
+        old_refs = compress([old.refdes[old_row] for old_row, _ in members])
+        new_refs = compress([new.refdes[new_row] for _, new_row in members])
+        original, modified = old.formatted(members[0][0]), new.formatted(members[0][1])
+        original["REFDES"], modified["REFDES"] = old_refs, new_refs
+        changes.append({"Reference": new_refs, "Original": original, "Modified": modified})
+    return changes
+
+def compare_tables(old: BomTable, new: BomTable, group: bool = False) -> Dict[str, Any]:
+    """Added, removed and changed parts between two parsed BOMs (the /compare-bom response)
+
+    group: identical parts share one entry whose REFDES is a compressed range list
+    ("C1-C40,C45") instead of one entry per reference designator
+    """
+    diff = diff_tables(old, new)
+    if group:
+        added = _grouped_parts(new, diff.added)
+        removed = _grouped_parts(old, diff.removed)
+        changed = _grouped_changes(old, new, diff.changed_old, diff.changed_new)
+    else:
+        added = [new.formatted(row) for row in diff.added]
+        removed = [old.formatted(row) for row in diff.removed]
+        changed = [
+            {
+                "Reference": new.refdes[new_row],
+                "Original": old.formatted(old_row),
+                "Modified": new.formatted(new_row)
+            }
+            for old_row, new_row in zip(diff.changed_old, diff.changed_new)
+        ]
+
+    logger.info(f"Comparison result: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "addedComponents": added,
+        "deletedComponents": removed,
+        "changedComponents": changed
+    }
+
+# Worker entry points (module-level so the pool can pickle them by reference).
+# Documents are parsed once into a serialized ParsedBom (cached by content hash);
+# the other jobs start from that.
+
+def parse_bom_path(path: str) -> bytes:
+    """Parse a spooled BOM file; returns the serialized ParsedBom"""
+    return parse_bom_document(read_file(path)).to_bytes()
+
+def parse_bom_member(path: str) -> bytes:
+    """Parse a bulk upload file (archive member), falling back to Latin-1 for files that
+    are not UTF-8; returns the serialized ParsedBom"""
+    with open(path, "rb") as f:
+        content = f.read()
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        text = content.decode("latin-1")
+    return parse_bom_document(split_chunks(text)).to_bytes()
+
+class ArchiveLimits(NamedTuple):
+    """Budget for unpacking bulk uploads (decompressed bytes are counted as they are read)"""
+    max_members: int
+    max_member_bytes: int
+    max_total_bytes: int
+
+class ArchiveTooLargeError(Exception):
+    """Raised when an upload holds more members or decompressed bytes than its budget"""
+
+class BulkMember(NamedTuple):
+    source_name: str
+    path: str
+    sha256: str
+
+def _copy_member(reader: BinaryIO, path: str, limit: int) -> Optional[str]:
+    """Copy a member to path chunk by chunk; returns its SHA-256, or None (and no file)
+    once it exceeds limit bytes"""
+    digest, size = hashlib.sha256(), 0
+    with open(path, "wb") as out:
+        while True:
+            chunk = reader.read(MEMBER_CHUNK_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            size += len(chunk)
+            if size > limit:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    os.unlink(path)
+    return None
+
+def unpack_bom_upload(path: str, filename: str, directory: str,
+                      limits: ArchiveLimits) -> Tuple[List[BulkMember], List[Dict[str, str]], ArchiveLimits]:
+    """Extract the .xml members of a zip/tar upload into a new folder under directory (a
+    plain file stands for itself); returns the members, per-file errors and the budget
+    left for further uploads of the same request
+
+    Every file entry counts against max_members, .xml or not. Members are written under
+    generated names, so archive paths never leave the folder. Raises ArchiveTooLargeError
+    once the member count or total size budget runs out.
+    """
+    folder = tempfile.mkdtemp(dir=directory)
+    members: List[BulkMember] = []
+    errors: List[Dict[str, str]] = []
+    max_members, max_total = limits.max_members, limits.max_total_bytes
+
+    def count_entry():
+        nonlocal max_members
+        if max_members <= 0:
+            raise ArchiveTooLargeError(f"More than {limits.max_members} files in upload")
+        max_members -= 1
+
+    def extract(name: str, reader: BinaryIO):
+        nonlocal max_total
+        member_path = os.path.join(folder, f"{len(members) + len(errors)}.xml")
+        with reader:
+            sha256 = _copy_member(reader, member_path, min(limits.max_member_bytes, max_total))
+        if sha256 is None:
+            if max_total < limits.max_member_bytes:
+                raise ArchiveTooLargeError(f"Upload exceeds {limits.max_total_bytes} decompressed bytes")
+            errors.append({"source": name, "error": f"File exceeds {limits.max_member_bytes} bytes"})
+            return
+        max_total -= os.path.getsize(member_path)
+        members.append(BulkMember(name, member_path, sha256))
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                count_entry()
+                if info.filename.lower().endswith(".xml"):
+                    extract(info.filename, archive.open(info))
+        return members, errors, ArchiveLimits(max_members, limits.max_member_bytes, max_total)
+    try:
+        archive = tarfile.open(path, mode="r:*")
+    except tarfile.ReadError:
+        count_entry()
+        extract(filename, open(path, "rb"))
+        return members, errors, ArchiveLimits(max_members, limits.max_member_bytes, max_total)
+    with archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            count_entry()
+            if member.name.lower().endswith(".xml"):
+                extract(member.name, archive.extractfile(member))
+    return members, errors, ArchiveLimits(max_members, limits.max_member_bytes, max_total)
+
+def compare_parsed(old_blob: bytes, new_blob: bytes, group: bool = False) -> bytes:
+    """Diff two parsed BOMs; returns the JSON response body"""
+    old = ParsedBom.from_bytes(old_blob).table
+    new = ParsedBom.from_bytes(new_blob).table
+    logger.info(f"Parsed components - Old: {len(old)}, New: {len(new)}")
+    return json_bytes(compare_tables(old, new, group))
+
+def preview_parsed(blob: bytes, filename: str) -> bytes:
+    """Preview of a parsed BOM; returns the JSON response body"""
+    table = ParsedBom.from_bytes(blob).table
+    return json_bytes({
+        "status": "success",
+        "message": f"Parsed {len(table)} components",
+        "filename": filename,
+        "component_count": len(table),
+        "components": table.to_components()
+    })
+
+def knowledge_of_parsed(blob: bytes) -> List[Tuple[str, ...]]:
+    """Knowledge-base components of a parsed BOM as knowledge_rows"""
+    return ParsedBom.from_bytes(blob).knowledge_rows()
+
+def store_revision(store: BomStore, revision_id: str, blob: bytes, info: Dict[str, Any]) -> Dict[str, Any]:
+    """Write a parsed BOM to the revision store; returns its stored description"""
+    return store.put(revision_id, ParsedBom.from_bytes(blob), info)
+
+def load_revision(store: BomStore, revision_id: str) -> bytes:
+    """Read a stored revision; returns the serialized ParsedBom"""
+    return store.get(revision_id).to_bytes()
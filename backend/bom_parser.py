@@ -0,0 +1,258 @@
+"""
+BOM XML parsing shared by the API endpoints, the RAG service, the bulk ingestion
+endpoint and the offline indexer
+Documents are parsed incrementally in a single pass: bytes are fed to a pull parser
+as they arrive, every element of every candidate layout is converted and dropped
+from the tree as soon as it closes, and the layout is picked once the document is
+complete, so memory follows the extracted components rather than the document.
+Functions are module-level so they can run in worker processes
+"""
+import logging
+import xml.etree.ElementTree as ET
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import refdes
+
+logger = logging.getLogger(__name__)
+
+# Per-component fields read from each RECORD element
+RECORD_FIELDS = ("REFDES", "PART-NAME", "PART-NUM", "CORP-NUM", "DESCRIPTION", "PACKAGE", "QTY", "OPT")
+# Fields of the comparison format (all layouts are mapped onto these plus REFDES)
+DETAIL_FIELDS = ("CORP-NUM", "DESCRIPTION", "NUMBER", "OPT", "PACKAGE", "PART-NAME", "PART-NUM", "QTY")
+# Bytes read from an upload at a time
+STREAM_CHUNK_SIZE = 1 << 20
+# Bytes handed to the XML parser between event drains
+PARSER_FEED_SIZE = 1 << 14
+
+# Layout candidates: component element tag -> priority; the highest-priority (lowest)
+# layout whose elements carry references wins. <DETAILS><RECORD> exports, then
+# <Component> lists, then generic part/item/row lists (elements at any depth).
+GENERIC_COMPONENT_TAGS = ("part", "component", "item", "element", "row", "component_info")
+_LAYOUT_PRIORITY: Dict[str, int] = {
+    "RECORD": 0,
+    "Component": 1,
+    **{tag: 2 + rank for rank, tag in enumerate(GENERIC_COMPONENT_TAGS)},
+}
+
+# Generic layout lookups (lower-cased attribute / child tag -> meaning)
+GENERIC_REF_TAGS = ("Reference", "Ref", "RefDes", "REFDES", "Designator", "RefDesignator", "id", "name")
+_GENERIC_REF_RANK: Dict[str, int] = {}
+for _rank, _tag in enumerate(GENERIC_REF_TAGS):
+    _GENERIC_REF_RANK.setdefault(_tag.lower(), _rank)
+_GENERIC_FIELDS = {
+    **dict.fromkeys(("partnumber", "part", "part-num", "pn", "part-number"), "PART-NUM"),
+    **dict.fromkeys(("description", "desc", "descr"), "DESCRIPTION"),
+    **dict.fromkeys(("quantity", "qty", "count"), "QTY"),
+    **dict.fromkeys(("package", "footprint", "pkgtype"), "PACKAGE"),
+}
+# <Component> child tag -> comparison field
+_COMPONENT_FIELDS = {"Reference": "REFDES", "Manufacturer": "CORP-NUM", "Description": "DESCRIPTION",
+                     "NUMBER": "NUMBER", "PartNumber": "PART-NUM", "Value": "QTY"}
+_DETAIL_TAGS = frozenset(DETAIL_FIELDS + ("REFDES",))
+
+XmlSource = Union[str, bytes]
+# (component element tag, component in the comparison fields)
+StreamedRecord = Tuple[str, Dict[str, str]]
+
+_EMPTY_COMPONENT = dict.fromkeys(DETAIL_FIELDS + ("REFDES",), "")
+
+def _empty_component() -> Dict[str, str]:
+    return _EMPTY_COMPONENT.copy()
+
+def _details_component(elem: ET.Element) -> Dict[str, str]:
+    """<RECORD> with one child per field"""
+    component = _empty_component()
+    for child in reversed(elem):  # Reversed so the first of repeated fields wins
+        if child.tag in _DETAIL_TAGS:
+            component[child.tag] = (child.text or "").strip()
+    return component
+
+def _component_component(elem: ET.Element) -> Dict[str, str]:
+    """<Component> with Reference / Manufacturer / PartNumber / Value children"""
+    component = _empty_component()
+    for child in reversed(elem):  # Reversed so the first of repeated fields wins
+        field = _COMPONENT_FIELDS.get(child.tag)
+        if field is not None:
+            component[field] = (child.text or "").strip()
+    return component
+
+def _generic_component(elem: ET.Element) -> Dict[str, str]:
+    """Generic element; the reference comes from a child element (preferred) or an attribute"""
+    component = _empty_component()
+    component["QTY"] = "1"  # Default quantity
+    refs = {}  # "attribute" / "child" -> (rank, reference)
+    for source, items in (("attribute", elem.attrib.items()),
+                          ("child", ((child.tag, child.text or "") for child in elem))):
+        # Child elements override attributes
+        for key, value in items:
+            key = key.lower()
+            value = value.strip()
+            rank = _GENERIC_REF_RANK.get(key)
+            if rank is not None and value and rank < refs.get(source, (len(GENERIC_REF_TAGS),))[0]:
+                refs[source] = (rank, value)
+            field = _GENERIC_FIELDS.get(key)
+            if field is not None:
+                component[field] = value
+    component["REFDES"] = (refs.get("child") or refs.get("attribute") or (None, ""))[1]
+    return component
+
+_EXTRACTORS: Dict[str, Callable[[ET.Element], Dict[str, str]]] = {
+    "RECORD": _details_component,
+    "Component": _component_component,
+}
+
+class BomStream:
+    """Incremental, single-pass BOM XML parser
+
+    Feed bytes (or str) chunks in order. Every element that is a component of some
+    candidate layout (see _LAYOUT_PRIORITY) is extracted when its end tag is parsed,
+    and records are returned tagged with their layout; every finished element outside
+    a candidate is dropped, so the tree never grows with the document. After close(),
+    component_tag is the highest-priority layout that produced records, so consumers
+    keep records per tag until then.
+    A malformed document stops the stream and sets error.
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._path: List[ET.Element] = []
+        self._in_component: List[bool] = []
+        self._open_components = 0
+        self._found: Dict[str, int] = {}  # Layout tag -> records produced
+        self.component_tag: Optional[str] = None
+        self.error: Optional[str] = None
+        self.bytes_read = 0
+
+    def feed(self, data: XmlSource) -> List[StreamedRecord]:
+        """Parse the next chunk (any size); returns the components closed by it"""
+        if self.error is not None:
+            return []
+        self.bytes_read += len(data)
+        records = []
+        try:
+            # Small feeds keep the pending event list and the partial tree small
+            for piece in split_chunks(data, PARSER_FEED_SIZE):
+                self._parser.feed(piece)
+                records.extend(self._drain())
+            return records
+        except ET.ParseError as e:
+            self.error = str(e)
+            return []
+
+    def close(self) -> List[StreamedRecord]:
+        """Finish the document and pick its layout; returns any components closed by the end of input"""
+        if self.error is not None:
+            return []
+        try:
+            self._parser.close()
+            records = self._drain()
+        except ET.ParseError as e:
+            self.error = str(e)
+            return []
+        if self._found:
+            self.component_tag = min(self._found, key=_LAYOUT_PRIORITY.__getitem__)
+        return records
+
+    def _drain(self) -> List[StreamedRecord]:
+        records = []
+        path, in_component, found = self._path, self._in_component, self._found
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                tag = elem.tag
+                is_component = tag in _LAYOUT_PRIORITY
+                if is_component:
+                    self._open_components += 1
+                in_component.append(is_component)
+                path.append(elem)
+                continue
+            path.pop()
+            if in_component.pop():
+                self._open_components -= 1
+                component = _EXTRACTORS.get(elem.tag, _generic_component)(elem)
+                if component["REFDES"]:  # Only keep components with a reference
+                    records.append((elem.tag, component))
+                    found[elem.tag] = found.get(elem.tag, 0) + 1
+                if not self._open_components:
+                    elem.clear()
+        # Detach finished elements from their open ancestors, one slice per ancestor
+        # (children of an open component are still needed)
+        for depth, elem in enumerate(path):
+            if in_component[depth]:
+                break
+            if depth + 1 < len(path):
+                del elem[:-1]  # The last child is the open element one level down
+            else:
+                del elem[:]
+        return records
+
+def split_chunks(content: XmlSource, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[XmlSource]:
+    """In-memory content in parser-sized pieces, so the partial tree stays small"""
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+def iter_records(chunks: Iterable[XmlSource], stream: Optional[BomStream] = None) -> Iterator[StreamedRecord]:
+    """Yield records as their elements close while feeding chunks through one BomStream"""
+    stream = stream or BomStream()
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+async def read_upload(upload, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Chunks of an uploaded file (anything with an async read(size), e.g. UploadFile)"""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def read_file(path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Chunks of a file on disk (e.g. an upload spooled for a worker process)"""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+# RAG knowledge format: every RECORD with a reference, no expansion
+
+def _knowledge_result(stream: BomStream, records: List[StreamedRecord]) -> Dict[str, Any]:
+    if stream.error is not None:
+        logger.error(f"Error parsing XML BOM: {stream.error}")
+        return {"components": [], "total_count": 0}
+    components = [
+        {field: component[field] for field in RECORD_FIELDS}
+        for tag, component in records if tag == "RECORD"
+    ]
+    logger.info(f"Parsed {len(components)} components from XML ({stream.bytes_read} bytes)")
+    return {
+        "components": components,
+        "total_count": len(components)
+    }
+
+def parse_xml_bom(xml_content: XmlSource) -> Dict[str, Any]:
+    """Parse XML BOM content into structured data"""
+    logger.info("Parsing XML BOM content...")
+    stream = BomStream()
+    return _knowledge_result(stream, list(iter_records(split_chunks(xml_content), stream)))
+
+def knowledge_from_rows(rows: List[Tuple[str, ...]]) -> Dict[str, Any]:
+    """parse_xml_bom result of components as value tuples in RECORD_FIELDS order"""
+    components = [dict(zip(RECORD_FIELDS, row)) for row in rows]
+    return {"components": components, "total_count": len(components)}
+
+def parse_bom_file(source_name: str, content: bytes) -> Tuple[str, Dict[str, Any]]:
+    """Decode and parse one uploaded file; returns (source_name, bom_data) for process pool callers"""
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        text = content.decode("latin-1")
+    return source_name, parse_xml_bom(text)
+
+# Comparison format: components keyed by (expanded) reference designator
+
+def expand_reference(ref: str) -> List[str]:
+    """The references one record lists (R1,R2 / R1-R5 / L40-41); a single reference as is"""
+    if ',' not in ref and '-' not in ref:
+        return [ref]
+    return list(refdes.expand(ref))
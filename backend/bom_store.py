@@ -0,0 +1,122 @@
+"""
+BOM revision store
+Uploaded revisions are kept parsed on local disk, addressed by the SHA-256 of their
+XML, so compares and RAG ingestion can refer to them by id instead of re-uploading
+and re-parsing them. A revision is an <id>.npz of ParsedBom.to_arrays (plain arrays,
+independent of the in-memory classes) with an <id>.json description next to it.
+"""
+import json
+import logging
+import os
+import re
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bom_parser import RECORD_FIELDS
+from bom_table import ARRAY_FORMAT_VERSION, ParsedBom
+
+logger = logging.getLogger(__name__)
+
+REVISION_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+PARSED_SUFFIX = ".npz"
+INFO_SUFFIX = ".json"
+
+class RevisionNotFoundError(LookupError):
+    """Raised for an unknown or malformed revision id, or a revision that can no longer be read"""
+
+class BomStore:
+    """Parsed revisions as <id>.npz files with an <id>.json description next to them"""
+
+    def __init__(self):
+        self.directory: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def open(self, directory: str) -> int:
+        """Use a directory (created if missing); returns the number of stored revisions"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        count = sum(1 for name in os.listdir(directory) if name.endswith(INFO_SUFFIX))
+        logger.info(f"BOM store at {directory}: {count} revisions")
+        return count
+
+    def _path(self, revision_id: str, suffix: str) -> str:
+        if self.directory is None:
+            raise RuntimeError("BOM store is not open")
+        if not REVISION_ID_PATTERN.fullmatch(revision_id):
+            raise RevisionNotFoundError(f"Unknown BOM revision: {revision_id}")
+        return os.path.join(self.directory, revision_id + suffix)
+
+    def __contains__(self, revision_id: str) -> bool:
+        """Whether a revision is stored readably in the current format (reads only the version)"""
+        try:
+            with np.load(self._path(revision_id, PARSED_SUFFIX), allow_pickle=False) as data:
+                return int(data["format_version"]) == ARRAY_FORMAT_VERSION
+        except (RevisionNotFoundError, OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return False
+
+    def _write(self, path: str, write):
+        """Write to a temporary file, then rename it into place"""
+        with open(path + ".tmp", "wb") as f:
+            write(f)
+        os.replace(path + ".tmp", path)
+
+    def put(self, revision_id: str, parsed: ParsedBom, info: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a parsed revision (replacing one in an older format)"""
+        info = {
+            **info,
+            "id": revision_id,
+            "component_count": len(parsed.table),
+            "record_count": len(parsed.records) // len(RECORD_FIELDS),
+            "format_version": ARRAY_FORMAT_VERSION,
+            "stored_at": datetime.now().isoformat(),
+        }
+        parsed_path = self._path(revision_id, PARSED_SUFFIX)
+        self._write(parsed_path, lambda f: np.savez(f, **parsed.to_arrays()))
+        self._write(self._path(revision_id, INFO_SUFFIX), lambda f: f.write(json.dumps(info).encode("utf-8")))
+        logger.info(f"Stored BOM revision {revision_id[:12]} ({os.path.getsize(parsed_path)} bytes)")
+        return info
+
+    def get(self, revision_id: str) -> ParsedBom:
+        """The parsed revision; an unreadable or outdated one is reported as not found"""
+        path = self._path(revision_id, PARSED_SUFFIX)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return ParsedBom.from_arrays({name: data[name] for name in data.files})
+        except FileNotFoundError:
+            if not os.path.exists(self._path(revision_id, INFO_SUFFIX)):
+                raise RevisionNotFoundError(f"Unknown BOM revision: {revision_id}") from None
+            reason = "no parsed file in the current format"
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            reason = str(e)
+        logger.warning(f"Cannot read BOM revision {revision_id[:12]}: {reason}")
+        raise RevisionNotFoundError(
+            f"BOM revision {revision_id} is stored in an unreadable or outdated format; upload it again"
+        )
+
+    def info(self, revision_id: str) -> Dict[str, Any]:
+        try:
+            with open(self._path(revision_id, INFO_SUFFIX), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise RevisionNotFoundError(f"Unknown BOM revision: {revision_id}") from None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Descriptions of all stored revisions, oldest first (outdated ones are flagged)"""
+        if self.directory is None:
+            return []
+        revisions = []
+        for name in os.listdir(self.directory):
+            if name.endswith(INFO_SUFFIX):
+                try:
+                    info = self.info(name[:-len(INFO_SUFFIX)])
+                except (RevisionNotFoundError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable BOM revision {name}: {e}")
+                    continue
+                revisions.append({**info, "outdated": info.get("format_version") != ARRAY_FORMAT_VERSION})
+        return sorted(revisions, key=lambda revision: revision.get("stored_at", ""))
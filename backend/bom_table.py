@@ -0,0 +1,281 @@
+"""
+Columnar in-memory BOM tables for parsing, previews and comparison
+A table keeps one array of string-pool codes per field (struct of arrays) plus a
+reference designator -> row index; every distinct value is stored once in a pool
+that tables built together share, so a diff compares integer columns
+"""
+import logging
+import pickle
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bom_parser import DETAIL_FIELDS, RECORD_FIELDS, BomStream, XmlSource, expand_reference
+
+logger = logging.getLogger(__name__)
+
+# Field columns of a table (REFDES is the row key, stored separately)
+COLUMNS = DETAIL_FIELDS
+# Fields whose difference makes a part "changed" in /compare-bom
+COMPARE_FIELDS = ("QTY", "CORP-NUM", "PART-NUM")
+# Layout of ParsedBom.to_arrays (bump when it changes incompatibly)
+ARRAY_FORMAT_VERSION = 1
+
+def _pack_strings(strings: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Strings as one UTF-8 buffer plus end offsets"""
+    encoded = [value.encode("utf-8") for value in strings]
+    return {
+        "data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "ends": np.cumsum([len(value) for value in encoded], dtype=np.int64),
+    }
+
+def _unpack_strings(data: np.ndarray, ends: np.ndarray) -> List[str]:
+    buffer = data.tobytes()
+    starts = [0, *ends[:-1].tolist()]
+    return [buffer[start:end].decode("utf-8") for start, end in zip(starts, ends.tolist())]
+
+class StringPool:
+    """Interned strings; code 0 is the empty string"""
+
+    def __init__(self, strings: Optional[List[str]] = None):
+        self.strings: List[str] = strings if strings is not None else [""]
+        self._codes: Dict[str, int] = {value: code for code, value in enumerate(self.strings)}
+
+    def code(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def find(self, value: str) -> int:
+        """Code of an interned value, or -1"""
+        return self._codes.get(value, -1)
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getstate__(self):
+        return self.strings
+
+    def __setstate__(self, strings: List[str]):
+        self.__init__(strings)
+
+class BomTable:
+    """BOM components as pooled columns, one row per reference designator
+
+    Adding a reference that is already present overwrites its row in place, like
+    assigning to a dict keyed by reference.
+    """
+
+    def __init__(self, pool: Optional[StringPool] = None):
+        self.pool = pool if pool is not None else StringPool()
+        self.refdes: List[str] = []
+        self.index: Dict[str, int] = {}
+        self._columns: Dict[str, array] = {field: array("I") for field in COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.refdes)
+
+    def __contains__(self, ref: str) -> bool:
+        return ref in self.index
+
+    def _put(self, ref: str, codes: Sequence[int]):
+        row = self.index.get(ref)
+        if row is None:
+            self.index[ref] = len(self.refdes)
+            self.refdes.append(ref)
+            for field, code in zip(COLUMNS, codes):
+                self._columns[field].append(code)
+        else:
+            for field, code in zip(COLUMNS, codes):
+                self._columns[field][row] = code
+
+    def add(self, component: Dict[str, str]):
+        """Add a component dict (REFDES plus any of COLUMNS)"""
+        self._put(component["REFDES"], [self.pool.code(component.get(field, "")) for field in COLUMNS])
+
+    def __getstate__(self):
+        return self.pool, self.refdes, self._columns
+
+    def __setstate__(self, state):
+        self.pool, self.refdes, self._columns = state
+        self.index = {ref: row for row, ref in enumerate(self.refdes)}
+
+    def codes(self, row: int) -> Tuple[int, ...]:
+        return tuple(self._columns[field][row] for field in COLUMNS)
+
+    def column(self, field: str) -> np.ndarray:
+        """Codes of one field for all rows (a view, no copy)"""
+        return np.frombuffer(self._columns[field], dtype=np.uint32)
+
+    def value(self, field: str, row: int) -> str:
+        return self.pool.strings[self._columns[field][row]]
+
+    def formatted(self, row: int) -> Dict[str, str]:
+        """One component in the /compare-bom part layout"""
+        value = self.value
+        return {
+            "REFDES": self.refdes[row],
+            "PartNumber": value("PART-NUM", row),
+            "QTY": value("QTY", row),
+            "OPT": value("OPT", row),
+            "DESCRIPTION": value("DESCRIPTION", row),
+            "PACKAGE": value("PACKAGE", row),
+            "PARTNAME": value("PART-NAME", row),
+            "NUMBER": value("NUMBER", row)
+        }
+
+    def to_components(self) -> Dict[str, Dict[str, str]]:
+        """Component dicts (COLUMNS plus REFDES) keyed by reference, as /api/bom/upload-fast returns them"""
+        strings = self.pool.strings
+        columns = [(field, self._columns[field]) for field in COLUMNS]
+        return {
+            ref: {**{field: strings[column[row]] for field, column in columns}, "REFDES": ref}
+            for row, ref in enumerate(self.refdes)
+        }
+
+    def expanded(self) -> "BomTable":
+        """One row per reference for rows listing several (R1,R2 / L40-41); rows share their codes"""
+        if not any(',' in ref or '-' in ref for ref in self.refdes):
+            return self
+        table = BomTable(self.pool)
+        for row, ref in enumerate(self.refdes):
+            codes = self.codes(row)
+            for expanded_ref in expand_reference(ref):
+                table._put(expanded_ref, codes)
+        logger.info(f"After expansion: {len(table)} individual components")
+        return table
+
+class TableDiff(NamedTuple):
+    added: np.ndarray  # Rows of the new table
+    removed: np.ndarray  # Rows of the old table
+    changed_old: np.ndarray  # Matching rows of changed parts
+    changed_new: np.ndarray
+
+def diff_tables(old: BomTable, new: BomTable, fields: Sequence[str] = COMPARE_FIELDS) -> TableDiff:
+    """Join two tables on reference and compare the given field columns
+
+    Rows come back in the order of their table (added/changed: new, removed: old).
+    Tables with different pools are compared after mapping old codes into the new pool.
+    """
+    new_to_old = np.fromiter((old.index.get(ref, -1) for ref in new.refdes), dtype=np.int64, count=len(new))
+    matched = new_to_old >= 0
+    matched_new = np.flatnonzero(matched)
+    matched_old = new_to_old[matched]
+
+    remap = None
+    if old.pool is not new.pool:
+        # Values missing from the new pool map to -1 and never compare equal
+        remap = np.fromiter((new.pool.find(value) for value in old.pool.strings), dtype=np.int64,
+                            count=len(old.pool))
+    differs = np.zeros(len(matched_new), dtype=bool)
+    for field in fields:
+        old_codes = old.column(field)[matched_old]
+        if remap is not None:
+            old_codes = remap[old_codes]
+        differs |= old_codes != new.column(field)[matched_new]
+
+    removed = np.fromiter((ref not in new.index for ref in old.refdes), dtype=bool, count=len(old))
+    return TableDiff(
+        added=np.flatnonzero(~matched),
+        removed=np.flatnonzero(removed),
+        changed_old=matched_old[differs],
+        changed_new=matched_new[differs],
+    )
+
+class ParsedBom(NamedTuple):
+    """Everything the endpoints use from one document, in one string pool
+
+    table is the comparison form (expanded, keyed by reference); records holds the RAG knowledge form
+    (parse_xml_bom: RECORD elements in document order, unexpanded) as RECORD_FIELDS codes
+    """
+    table: BomTable
+    records: array
+
+    def knowledge_rows(self) -> List[Tuple[str, ...]]:
+        """The records as value tuples in RECORD_FIELDS order (see knowledge_from_rows)"""
+        strings, width = self.table.pool.strings, len(RECORD_FIELDS)
+        codes = self.records
+        return [tuple(strings[code] for code in codes[start:start + width])
+                for start in range(0, len(codes), width)]
+
+    def to_bytes(self) -> bytes:
+        """Compact serialized form for the parse cache and worker hand-off (not for storage: see to_arrays)"""
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def from_bytes(blob: bytes) -> "ParsedBom":
+        return pickle.loads(blob)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Class-independent form for storage: packed strings, field names and code columns"""
+        table = self.table
+        arrays = {"format_version": np.array(ARRAY_FORMAT_VERSION)}
+        for name, strings in (("strings", table.pool.strings), ("refdes", table.refdes),
+                              ("columns", COLUMNS), ("record_fields", RECORD_FIELDS)):
+            for part, values in _pack_strings(strings).items():
+                arrays[f"{name}_{part}"] = values
+        for field in COLUMNS:
+            arrays[f"column_{field}"] = table.column(field)
+        arrays["records"] = np.frombuffer(self.records, dtype=np.uint32)
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays: Dict[str, np.ndarray]) -> "ParsedBom":
+        """Inverse of to_arrays; fields are matched by name (missing ones are blank).
+        Raises ValueError for another format version"""
+        version = int(arrays["format_version"])
+        if version != ARRAY_FORMAT_VERSION:
+            raise ValueError(f"BOM array format {version}, expected {ARRAY_FORMAT_VERSION}")
+
+        def unpack(name: str) -> List[str]:
+            return _unpack_strings(arrays[f"{name}_data"], arrays[f"{name}_ends"])
+
+        table = BomTable(StringPool(unpack("strings")))
+        table.refdes = unpack("refdes")
+        table.index = {ref: row for row, ref in enumerate(table.refdes)}
+        stored_columns = set(unpack("columns"))
+        for field in COLUMNS:
+            codes = arrays[f"column_{field}"] if field in stored_columns else np.zeros(len(table), np.uint32)
+            table._columns[field] = array("I", codes.astype(np.uint32).tobytes())
+
+        stored_fields = unpack("record_fields")
+        stored = arrays["records"].astype(np.uint32).reshape(-1, len(stored_fields))
+        records = np.zeros((len(stored), len(RECORD_FIELDS)), dtype=np.uint32)
+        for position, field in enumerate(RECORD_FIELDS):
+            if field in stored_fields:
+                records[:, position] = stored[:, stored_fields.index(field)]
+        return ParsedBom(table, array("I", records.tobytes()))
+
+def parse_bom_document(chunks: Iterable[XmlSource], pool: Optional[StringPool] = None) -> ParsedBom:
+    """Comparison table and knowledge records of a document in one pass; component dicts
+    only live for one parser feed"""
+    pool = pool if pool is not None else StringPool()
+    stream = BomStream()
+    tables: Dict[str, BomTable] = {}  # Per component tag, in case a tentative layout is superseded
+    records = array("I")
+
+    def add(batch):
+        for tag, component in batch:
+            table = tables.get(tag)
+            if table is None:
+                table = tables[tag] = BomTable(pool)
+            table.add(component)
+            if tag == "RECORD":
+                records.extend(pool.code(component[field]) for field in RECORD_FIELDS)
+
+    for chunk in chunks:
+        add(stream.feed(chunk))
+    add(stream.close())
+    if stream.error is not None:
+        logger.error(f"Error in XML parsing: {stream.error}")
+        return ParsedBom(BomTable(pool), array("I"))
+    logger.info(f"Parsed {len(records) // len(RECORD_FIELDS)} knowledge records from XML")
+    table = tables.get(stream.component_tag)
+    if table is None:
+        logger.warning("No components found in any known XML layout. Returning empty component table.")
+        return ParsedBom(BomTable(pool), records)
+    logger.info(f"Parsed {len(table)} components from <{stream.component_tag}> elements ({stream.bytes_read} bytes)")
+    return ParsedBom(table.expanded() if stream.component_tag == "RECORD" else table, records)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Offline knowledge-base builder
+Parses a directory of BOM XMLs on all cores, embeds the components through Ollama and
+writes the same snapshot layout the server memory-maps at startup (RAG_DATA_DIR)
+
+Usage:
+    python build_index.py boms/ --output rag_data --concurrency 8
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Tuple
+
+from bom_parser import parse_bom_file
+from memory_rag_service import MemoryRAGService
+from memory_vectordb import EmbeddingUnavailableError, MemoryVectorDB
+
+logger = logging.getLogger("build-index")
+
+def parse_path(root: str, path: str) -> Tuple[str, Dict[str, Any]]:
+    """Worker: parse one file; its path relative to the input directory is the source name"""
+    with open(path, "rb") as f:
+        return parse_bom_file(os.path.relpath(path, root).replace(os.sep, "/"), f.read())
+
+def find_boms(root: str):
+    for directory, _, names in os.walk(root):
+        for name in sorted(names):
+            if name.lower().endswith(".xml"):
+                yield os.path.join(directory, name)
+
+async def build(args) -> int:
+    paths = sorted(find_boms(args.input))
+    if not paths:
+        print(f"No .xml files under {args.input}")
+        return 1
+
+    service = MemoryRAGService(precision=args.precision, rescore_candidates=args.rescore_candidates,
+                               data_dir=args.output, ollama_url=args.ollama_url)
+    dirs = service._snapshot_dirs()
+    for directory in dirs.values():
+        wal_dir = os.path.join(directory, "wal")
+        if os.path.isdir(wal_dir) and os.listdir(wal_dir):
+            print(f"{directory} holds a live knowledge base (write-ahead log present); build into an empty directory")
+            return 1
+    service.embedding_client.batch_size = args.batch_size
+    service.embedding_client.max_concurrency = args.concurrency
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        parsed = await asyncio.gather(*[loop.run_in_executor(pool, parse_path, args.input, path) for path in paths])
+    boms = [(source_name, bom_data) for source_name, bom_data in parsed if bom_data.get("components")]
+    components = sum(len(bom_data["components"]) for _, bom_data in boms)
+    print(f"Parsed {components} components from {len(boms)} of {len(paths)} files "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    # Embeddings already computed by earlier builds (or the server) are reused
+    service.embedding_cache.open(os.path.join(args.output, "embedding_cache.sqlite"))
+    last_report = 0.0
+
+    def report(current: int, total: int, files):
+        nonlocal last_report
+        now = time.perf_counter()
+        if now - last_report >= 1.0 or current == total:
+            last_report = now
+            print(f"  embedded {current}/{total} components", flush=True)
+
+    start = time.perf_counter()
+    try:
+        await service.add_boms_to_knowledge_with_progress(boms, report)
+    except EmbeddingUnavailableError as e:
+        print(f"{e} (is Ollama reachable at {args.ollama_url}?); no snapshot written.")
+        await service.close()
+        return 1
+    embed_seconds = time.perf_counter() - start
+
+    for name, db in (("components", service.components_db), ("patterns", service.patterns_db)):
+        path = db.save_snapshot(dirs[name])
+        print(f"Wrote {db.count()} {name} to {path}")
+    cache = service.embedding_cache.get_stats()
+    print(f"Embedded in {embed_seconds:.1f}s; cache hits {cache['memory_hits'] + cache['disk_hits']}, "
+          f"misses {cache['misses']}")
+    await service.close()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a knowledge-base snapshot from a directory of BOM XMLs")
+    parser.add_argument("input", help="Directory searched recursively for .xml files")
+    parser.add_argument("--output", default="rag_data", help="Data directory to write (the server's RAG_DATA_DIR)")
+    parser.add_argument("--ollama-url", default="http://localhost:11434")
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts per /api/embed request")
+    parser.add_argument("--concurrency", type=int, default=8, help="Embedding requests in flight")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parser processes")
+    parser.add_argument("--precision", choices=list(MemoryVectorDB.PRECISIONS), default="float32")
+    parser.add_argument("--rescore-candidates", type=int, default=0)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    sys.exit(asyncio.run(build(parser.parse_args())))
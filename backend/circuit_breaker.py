@@ -0,0 +1,114 @@
+"""
+Circuit breaker for calls to an Ollama server
+After consecutive failures calls fail immediately instead of waiting for timeouts;
+one trial call is let through once the reset timeout has passed
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit is open"""
+
+class CircuitBreaker:
+    """Closed -> open after failure_threshold consecutive failures; open -> half-open after reset_timeout"""
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 15.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._last_error: Optional[str] = None
+        self._last_change = time.time()
+        self._lock = threading.Lock()
+        self.rejected_calls = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def _set_state(self, state: str):
+        if state != self._state:
+            self._state = state
+            self._last_change = time.time()
+
+    def _acquire(self) -> Optional[bool]:
+        """None if a call may not be made now, else whether it is the half-open trial (now reserved)"""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self._state == CLOSED:
+                return False
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected_calls += 1
+            return None
+
+    def allow(self) -> bool:
+        """Whether a call may be made now (reserves the single trial call when half-open)"""
+        return self._acquire() is not None
+
+    def check(self) -> bool:
+        """Raise CircuitOpenError unless a call may be made now; returns whether the call is the
+        half-open trial, which must end in record_success, record_failure or release_trial"""
+        trial = self._acquire()
+        if trial is None:
+            raise CircuitOpenError(f"Circuit for {self.name} is open after {self._consecutive_failures} "
+                                   f"consecutive failures: {self._last_error}")
+        return trial
+
+    def release_trial(self):
+        """Give back a reserved trial whose call ended without an outcome (e.g. it was cancelled)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            self._last_error = None
+            self._set_state(CLOSED)
+
+    def record_failure(self, error: Optional[BaseException] = None):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            if error is not None:
+                self._last_error = str(error) or type(error).__name__
+            if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_seconds": self.reset_timeout,
+            "rejected_calls": self.rejected_calls,
+            "last_error": self._last_error,
+            "last_state_change": self._last_change,
+        }
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(url: str, **kwargs) -> CircuitBreaker:
+    """The breaker shared by every client of one server URL"""
+    key = url.rstrip("/")
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(key, **kwargs)
+        return breaker
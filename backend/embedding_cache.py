@@ -0,0 +1,135 @@
+"""
+Content-addressed embedding cache
+Embeddings are keyed by (embedding model, sha256 of the text) so unchanged BOM
+lines are never sent to Ollama twice; a small LRU sits in front of a SQLite file
+Methods block on SQLite and are thread-safe, so async callers run them via asyncio.to_thread
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Parameters per SQLite IN (...) lookup, below the default SQLITE_MAX_VARIABLE_NUMBER
+LOOKUP_CHUNK = 500
+
+def content_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    """Two-tier (memory LRU, optional SQLite) cache of float32 embeddings"""
+
+    def __init__(self, max_memory_entries: int = 20000):
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self.path: Optional[str] = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_entries = 0  # Rows in the SQLite tier, counted once on open and kept up to date
+
+    def open(self, path: str):
+        """Attach the on-disk tier (created if missing)"""
+        self.close()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash)) WITHOUT ROWID"
+        )
+        self._db.commit()
+        self.disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.path = path
+        logger.info(f"Opened embedding cache at {path}")
+
+    def close(self):
+        with self._lock:  # Not while a worker thread is inside a lookup or commit
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                self.disk_entries = 0
+
+    def _remember(self, key: tuple, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached embedding per text, or None where the text has not been embedded yet"""
+        keys = [(model, content_hash(text)) for text in texts]
+        found: List[Optional[np.ndarray]] = [None] * len(keys)
+        missing: Dict[bytes, List[int]] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key[1], []).append(i)
+
+            if missing and self._db is not None:
+                hashes = list(missing)
+                for start in range(0, len(hashes), LOOKUP_CHUNK):
+                    chunk = hashes[start:start + LOOKUP_CHUNK]
+                    rows = self._db.execute(
+                        f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(chunk))})",
+                        [model, *chunk]
+                    ).fetchall()
+                    for digest, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember((model, digest), vector)
+                        for i in missing.pop(digest):
+                            found[i] = vector
+                            self.disk_hits += 1
+            self.misses += sum(len(positions) for positions in missing.values())
+        return [vector.tolist() if vector is not None else None for vector in found]
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[List[float]]):
+        """Store real (non-mock) embeddings for the given texts"""
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = (model, content_hash(text))
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((model, key[1], vector.tobytes()))
+            if rows and self._db is not None:
+                # An embedding is a function of (model, text), so a stored row never needs replacing
+                inserted = self._db.executemany(
+                    "INSERT OR IGNORE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)", rows
+                ).rowcount
+                self._db.commit()
+                self.disk_entries += inserted
+
+    def put(self, model: str, text: str, embedding: List[float]):
+        self.put_many(model, [text], [embedding])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self.disk_entries if self._db is not None else None,
+            "path": self.path,
+        }
@@ -0,0 +1,173 @@
+"""
+Priority scheduling of embedding requests to one Ollama server
+Interactive (query) embeddings are admitted ahead of bulk (ingestion) batches,
+and bulk work is capped by an adaptive in-flight limit so queries never queue
+behind a whole ingestion backlog
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Highest priority first
+PRIORITIES = (INTERACTIVE, BULK)
+# Wait times kept per class for percentiles
+WAIT_SAMPLES = 1024
+
+class AdaptiveConcurrencyLimiter:
+    """Concurrency limit that grows additively while latency stays near the best seen
+    and halves when requests slow down or fail (AIMD)"""
+
+    def __init__(self, min_limit: int = 1, max_limit: int = 4, latency_tolerance: float = 2.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.limit = self.min_limit
+        self._best_latency: Optional[float] = None  # Per-text seconds on an unloaded server
+        self._last_latency: Optional[float] = None
+
+    def record(self, seconds: float, texts: int):
+        """Feed back the latency of a finished request"""
+        latency = seconds / max(texts, 1)
+        self._last_latency = latency
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        if latency <= self._best_latency * self.latency_tolerance:
+            self.limit = min(self.max_limit, self.limit + 1)
+        else:
+            self.limit = max(self.min_limit, self.limit // 2)
+
+    def record_failure(self):
+        self.limit = max(self.min_limit, self.limit // 2)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "max_limit": self.max_limit,
+            "best_latency_ms_per_text": round(self._best_latency * 1000, 3) if self._best_latency else None,
+            "last_latency_ms_per_text": round(self._last_latency * 1000, 3) if self._last_latency else None,
+        }
+
+class _PriorityClass:
+    """Queue and counters of one priority class"""
+
+    def __init__(self):
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.in_flight = 0
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, seconds: float):
+        self.admitted += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+        self.recent_waits.append(seconds)
+
+    def get_stats(self, capacity: int) -> Dict[str, Any]:
+        waits = sorted(self.recent_waits)
+        return {
+            "queue_depth": len(self.waiting),
+            "in_flight": self.in_flight,
+            "capacity": capacity,
+            "admitted": self.admitted,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 3) if self.admitted else 0.0,
+            "p99_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3) if waits else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+class EmbeddingScheduler:
+    """Admits embedding requests by priority class
+
+    Interactive requests start whenever fewer than interactive_max_in_flight are running.
+    Bulk requests start only while no interactive request is waiting and fewer than the
+    adaptive bulk limit (at most bulk_max_in_flight) are running.
+    """
+
+    def __init__(self, bulk_max_in_flight: int = 4, interactive_max_in_flight: int = 8):
+        self.bulk_limiter = AdaptiveConcurrencyLimiter(max_limit=bulk_max_in_flight)
+        self.interactive_max_in_flight = max(1, interactive_max_in_flight)
+        self._classes = {priority: _PriorityClass() for priority in PRIORITIES}
+
+    def _capacity(self, priority: str) -> int:
+        return self.interactive_max_in_flight if priority == INTERACTIVE else self.bulk_limiter.limit
+
+    def _can_start(self, priority: str) -> bool:
+        if self._classes[priority].in_flight >= self._capacity(priority):
+            return False
+        return priority == INTERACTIVE or not self._classes[INTERACTIVE].waiting
+
+    def _dispatch(self):
+        for priority in PRIORITIES:
+            cls = self._classes[priority]
+            while cls.waiting and self._can_start(priority):
+                waiter = cls.waiting.popleft()
+                if waiter.done():
+                    continue  # Cancelled while queued
+                cls.in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self, priority: str = BULK):
+        cls = self._classes[priority]
+        started = time.monotonic()
+        if not cls.waiting and self._can_start(priority):
+            cls.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            cls.waiting.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.cancelled():
+                    if waiter in cls.waiting:
+                        cls.waiting.remove(waiter)
+                else:
+                    self.release(priority)  # Admitted just before the cancellation arrived
+                raise
+        cls.record_wait(time.monotonic() - started)
+
+    def release(self, priority: str = BULK):
+        self._classes[priority].in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: str = BULK):
+        """Hold one in-flight slot of the given class for the duration of a request"""
+        if priority not in self._classes:
+            raise ValueError(f"Unknown embedding priority '{priority}', expected one of {list(PRIORITIES)}")
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def record_bulk_latency(self, seconds: float, texts: int):
+        """Feed a finished bulk request into the adaptive bulk limit"""
+        self.bulk_limiter.record(seconds, texts)
+        self._dispatch()  # The limit may have grown
+
+    def record_bulk_failure(self):
+        self.bulk_limiter.record_failure()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, in-flight count and wait times per priority class"""
+        stats = {priority: cls.get_stats(self._capacity(priority)) for priority, cls in self._classes.items()}
+        stats["bulk_limiter"] = self.bulk_limiter.get_stats()
+        return stats
+
+_schedulers: Dict[str, EmbeddingScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(url: str, **kwargs) -> EmbeddingScheduler:
+    """The scheduler shared by every embedding client of one server URL"""
+    key = url.rstrip("/")
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = EmbeddingScheduler(**kwargs)
+        return scheduler
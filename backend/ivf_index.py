@@ -0,0 +1,159 @@
+"""
+Approximate nearest-neighbour index for MemoryVectorDB
+Inverted file (IVF) over spherical k-means centroids, pure numpy
+"""
+import logging
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class IVFIndex:
+    """Inverted-file index: rows are bucketed by their nearest k-means centroid
+
+    Only the n_probe buckets closest to a query are scored, so search cost is
+    roughly n_probe / n_lists of a brute-force scan. Raise n_probe for recall,
+    lower it for latency.
+    """
+
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8, min_train_size: int = 50000,
+                 retrain_growth: float = 4.0, kmeans_iterations: int = 10, sample_per_list: int = 64,
+                 seed: int = 0):
+        self.n_lists = n_lists  # None picks ~4*sqrt(N) lists at training time
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size  # Below this size search stays exact
+        self.retrain_growth = retrain_growth  # Retrain once the data grows by this factor
+        self.kmeans_iterations = kmeans_iterations
+        self.sample_per_list = sample_per_list
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[array] = []
+        self.trained_size = 0
+        self.size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def needs_training(self, total_rows: int) -> bool:
+        """Whether the index should be (re)built for a store of the given size"""
+        if total_rows < self.min_train_size:
+            return False
+        if not self.is_trained:
+            return True
+        return total_rows >= self.trained_size * self.retrain_growth
+
+    def _kmeans(self, sample: np.ndarray, n_lists: int) -> np.ndarray:
+        """Spherical k-means on unit-length rows; returns normalized centroids"""
+        rng = np.random.default_rng(self.seed)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            if empty.any():
+                # Re-seed empty lists from random rows so every list stays useful
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+                norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = sums / norms[:, None]
+        return centroids.astype(np.float32)
+
+    def fit(self, load_rows: Callable[[np.ndarray], np.ndarray], total: int) -> Tuple[np.ndarray, List[array]]:
+        """Centroids fitted on a sample of rows 0..total-1 and the lists of all of them
+
+        Leaves the index untouched, so it can run on another thread while the current
+        index keeps serving; install() swaps the result in. load_rows maps an array of
+        row ids to their normalized float32 vectors, so compact (float16/int8) stores
+        are widened only a block at a time.
+        """
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(total)))
+        n_lists = min(n_lists, total)
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(total, n_lists * self.sample_per_list)
+        sample_rows = np.sort(rng.choice(total, sample_size, replace=False))
+        centroids = self._kmeans(load_rows(sample_rows), n_lists)
+        lists = [array("q") for _ in range(n_lists)]
+        self._assign(centroids, lists, np.arange(total), load_rows)
+        logger.info(f"Trained IVF index with {n_lists} lists on {sample_size} of {total} rows")
+        return centroids, lists
+
+    def install(self, centroids: np.ndarray, lists: List[array], trained_size: int):
+        """Serve from fitted centroids and lists covering rows 0..trained_size-1"""
+        self.centroids = centroids
+        self._lists = lists
+        self.size = sum(len(lst) for lst in lists)
+        self.trained_size = trained_size
+
+    def train(self, load_rows: Callable[[np.ndarray], np.ndarray], total: int):
+        """Fit and install in one blocking call"""
+        self.install(*self.fit(load_rows, total), total)
+
+    def assignment(self) -> np.ndarray:
+        """List id of every indexed row (rows are 0..size-1), for storing the index"""
+        assignment = np.empty(self.size, dtype=np.int32)
+        for list_id, lst in enumerate(self._lists):
+            assignment[np.frombuffer(lst, dtype=np.int64)] = list_id
+        return assignment
+
+    def restore(self, centroids: np.ndarray, assignment: np.ndarray, trained_size: int):
+        """Rebuild the lists from stored centroids and assignment() without any training"""
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.cumsum(np.bincount(assignment, minlength=len(centroids)))[:-1]
+        lists = [array("q", chunk.astype(np.int64).tobytes()) for chunk in np.split(order, bounds)]
+        self.install(np.ascontiguousarray(centroids, dtype=np.float32), lists, trained_size)
+
+    @staticmethod
+    def _assign(centroids: np.ndarray, lists: List[array], rows: np.ndarray,
+                load_rows: Callable[[np.ndarray], np.ndarray], block_rows: int = 65536):
+        for start in range(0, len(rows), block_rows):
+            block_ids = rows[start:start + block_rows]
+            assignment = np.argmax(load_rows(block_ids) @ centroids.T, axis=1)
+            for row, list_id in zip(block_ids.tolist(), assignment.tolist()):
+                lists[list_id].append(row)
+
+    def add_batch(self, rows: np.ndarray, load_rows: Callable[[np.ndarray], np.ndarray], block_rows: int = 65536):
+        """Assign rows to their nearest centroid lists"""
+        self._assign(self.centroids, self._lists, rows, load_rows, block_rows)
+        self.size += len(rows)
+
+    def add(self, row: int, vector: np.ndarray):
+        """Assign a single new row"""
+        list_id = int(np.argmax(self.centroids @ vector))
+        self._lists[list_id].append(row)
+        self.size += 1
+
+    def candidates(self, query: np.ndarray, n_probe: Optional[int] = None) -> np.ndarray:
+        """Row ids stored in the n_probe lists closest to the query"""
+        n_probe = min(n_probe or self.n_probe, len(self._lists))
+        closeness = self.centroids @ query
+        probed = np.argpartition(-closeness, n_probe - 1)[:n_probe]
+        buckets = [np.frombuffer(self._lists[i], dtype=np.int64) for i in probed if len(self._lists[i])]
+        if not buckets:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(buckets)
+
+    def reset(self):
+        """Drop centroids and lists"""
+        self.centroids = None
+        self._lists = []
+        self.trained_size = 0
+        self.size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index statistics"""
+        sizes = [len(lst) for lst in self._lists]
+        return {
+            "type": "ivf",
+            "trained": self.is_trained,
+            "n_lists": len(self._lists),
+            "n_probe": self.n_probe,
+            "min_train_size": self.min_train_size,
+            "indexed_rows": self.size,
+            "largest_list": max(sizes) if sizes else 0
+        }
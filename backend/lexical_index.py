@@ -0,0 +1,97 @@
+"""
+BM25 inverted-token index over document content
+Finds exact part numbers and reference designators that embeddings rank poorly
+"""
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Keeps part-number style tokens whole: "crcw0603", "123-456", "0.1uf", "rc0402fr-0710kl"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+TOKEN_SEPARATORS = re.compile(r"[-./]")
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased tokens; compound tokens also contribute their pieces"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if TOKEN_SEPARATORS.search(token):
+            tokens.extend(piece for piece in TOKEN_SEPARATORS.split(token) if piece)
+    return tokens
+
+class BM25Index:
+    """Okapi BM25 over rows appended in increasing order"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths = array("I")
+        self._total_length = 0
+
+    def add(self, row: int, text: str, keywords: str = ""):
+        """Index the text of a newly appended row
+
+        keywords are matched like text but left out of the row length, so a part listing
+        hundreds of designators is not ranked down for every other query.
+        """
+        while len(self._lengths) < row:
+            self._lengths.append(0)  # Rows without indexed text
+        counts = Counter(tokenize(text))
+        self._lengths.append(sum(counts.values()))
+        counts.update(tokenize(keywords))
+        self._total_length += self._lengths[row]
+        for token, tf in counts.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = (array("q"), array("I"))
+            postings[0].append(row)
+            postings[1].append(tf)
+
+    def search(self, query: str, n_results: int = 5, rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top (row, bm25 score) pairs, optionally restricted to a sorted array of rows"""
+        total_docs = len(self._lengths)
+        if total_docs == 0 or n_results <= 0:
+            return []
+        average_length = self._total_length / total_docs or 1.0
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+
+        hit_rows, hit_scores = [], []
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            token_rows = np.frombuffer(postings[0], dtype=np.int64).copy()
+            tf = np.frombuffer(postings[1], dtype=np.uint32).astype(np.float32)
+            df = len(token_rows)
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[token_rows].astype(np.float32) / average_length)
+            hit_rows.append(token_rows)
+            hit_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not hit_rows:
+            return []
+
+        # Sum per-token contributions for each matching row (sparse, no O(N) buffers)
+        matched, inverse = np.unique(np.concatenate(hit_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores))
+        if rows is not None:
+            keep = np.isin(matched, rows, assume_unique=True)
+            matched, scores = matched[keep], scores[keep]
+        if matched.size > n_results:
+            best = np.argpartition(-scores, n_results - 1)[:n_results]
+            matched, scores = matched[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(matched[i]), float(scores[i])) for i in order]
+
+    def reset(self):
+        self._postings = {}
+        self._lengths = array("I")
+        self._total_length = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """Index size"""
+        return {"indexed_rows": len(self._lengths), "distinct_tokens": len(self._postings)}
@@ -1,18 +1,31 @@
-from fastapi import FastAPI, UploadFile, File, Request, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Request, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from typing import List, Dict, Any, Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import List, Dict, Any, NamedTuple, Optional
 from pydantic import BaseModel
-import xml.etree.ElementTree as ET
 import logging
 import sys
 import traceback
 import json
 import aiohttp
 import asyncio
-import uuid
-from datetime import datetime
+import hashlib
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from bom_jobs import (
+    ArchiveLimits, ArchiveTooLargeError, BulkMember, compare_parsed, knowledge_of_parsed, load_revision,
+    parse_bom_member, parse_bom_path, preview_parsed, store_revision, unpack_bom_upload
+)
+from bom_parser import knowledge_from_rows, read_upload
+from bom_store import BomStore, RevisionNotFoundError
+from bom_table import BomTable, StringPool, diff_tables
 from memory_rag_service import memory_rag_service
+from memory_vectordb import EmbeddingUnavailableError
+from parse_cache import ParseCache
+from parse_pool import ParsePool, ParsePoolFullError
+from refdes import compress as compress_refdes
+from task_manager import TaskDeferred, TaskManager, TaskStatus
 
 # Configure logging
 logging.basicConfig(
@@ -33,20 +46,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Background task tracking
-background_tasks_status = {}
+# Background tasks run on a bounded worker pool; finished ones expire after a TTL
+task_manager = TaskManager(
+    max_workers=int(os.getenv("RAG_TASK_WORKERS", "2")),
+    ttl_seconds=float(os.getenv("RAG_TASK_TTL_SECONDS", "3600")),
+    max_finished=int(os.getenv("RAG_TASK_MAX_FINISHED", "200")),
+    event_interval=float(os.getenv("RAG_TASK_EVENT_INTERVAL", "0.25")),
+    max_deferrals=int(os.getenv("RAG_TASK_MAX_PAUSES", "40"))
+)
+# BOM files are parsed and diffed in worker processes, off the event loop
+PARSE_WORKERS = int(os.getenv("RAG_PARSE_WORKERS", str(os.cpu_count() or 1)))
+parse_pool = ParsePool(
+    max_workers=PARSE_WORKERS,
+    max_pending=int(os.getenv("RAG_PARSE_MAX_PENDING", str(PARSE_WORKERS * 4)))
+)
+# Parsed documents by content hash, so re-uploads of the same file skip parsing
+parse_cache = ParseCache(max_bytes=int(os.getenv("RAG_PARSE_CACHE_BYTES", str(256 << 20))))
+# Bulk uploads (archives) may hold at most this many files and decompressed bytes
+BULK_LIMITS = ArchiveLimits(
+    max_members=int(os.getenv("RAG_BULK_MAX_FILES", "1000")),
+    max_member_bytes=int(os.getenv("RAG_BULK_MAX_FILE_BYTES", str(256 << 20))),
+    max_total_bytes=int(os.getenv("RAG_BULK_MAX_TOTAL_BYTES", str(2 << 30)))
+)
+# Uploaded BOM revisions kept parsed on disk (under RAG_DATA_DIR) and referenced by id
+bom_store = BomStore()
 
-class TaskStatus:
-    def __init__(self, task_id: str, task_type: str, total_items: int = 0):
-        self.task_id = task_id
-        self.task_type = task_type
-        self.status = "running"  # running, completed, failed
-        self.progress = 0
-        self.total_items = total_items
-        self.message = ""
-        self.started_at = datetime.now()
-        self.completed_at = None
-        self.error = None
+# Seconds between SSE comments that keep idle task streams open through proxies
+TASK_STREAM_KEEPALIVE = 15
+# Component fields shown in RAG prompt context; results equal in all of them share one entry
+PROMPT_COMPONENT_FIELDS = ("PART-NAME", "PART-NUM", "DESCRIPTION", "PACKAGE", "QTY", "OPT", "source")
 
 # Pydantic models for AI chat
 class ChatMessage(BaseModel):
@@ -74,6 +102,49 @@ class OllamaGenerateRequest(BaseModel):
     stream: bool = False
     options: Optional[Dict[str, Any]] = None
 
+class CompareRevisionsRequest(BaseModel):
+    old_id: str
+    new_id: str
+    group: bool = False  # One entry per identical part with compressed REFDES ranges
+
+class AddRevisionRequest(BaseModel):
+    revision_id: str
+    source_name: str
+    create_embeddings: bool = True
+
+@app.on_event("startup")
+async def restore_knowledge_base():
+    """Memory-map the last knowledge base snapshot and replay the write-ahead log"""
+    try:
+        memory_rag_service.open_storage()
+    except Exception as e:
+        logger.error(f"Failed to restore knowledge base snapshot: {e}")
+    memory_rag_service.start_health_probe()
+    
+    # Task state lives next to the knowledge base so interrupted ingestions resume against it
+    task_manager.register("embedding_creation", create_embeddings_background)
+    task_manager.register("bulk_embedding_creation", create_bulk_embeddings_background)
+    if memory_rag_service.data_dir:
+        try:
+            task_manager.open(os.path.join(memory_rag_service.data_dir, "tasks.sqlite"))
+        except Exception as e:
+            logger.error(f"Failed to load background task state: {e}")
+        try:
+            bom_store.open(os.path.join(memory_rag_service.data_dir, "bom_revisions"))
+        except Exception as e:
+            logger.error(f"Failed to open BOM store: {e}")
+    await task_manager.start()
+
+@app.on_event("shutdown")
+async def persist_knowledge_base():
+    """Snapshot the knowledge base and flush the write-ahead log on graceful shutdown"""
+    try:
+        await task_manager.stop()
+        await memory_rag_service.close()
+        parse_pool.shutdown()
+    except Exception as e:
+        logger.error(f"Failed to close knowledge base storage: {e}")
+
 @app.get("/")
 def read_root():
     return {"message": "Hello from FastAPI backend!"}
@@ -84,306 +155,67 @@ async def health_check():
     """Simple health check endpoint"""
     return {"status": "ok", "message": "Backend is running"}
 
-# Helper to parse BOM XML and ignore Description and NUMBER
-def parse_bom_xml(xml_content: str) -> Dict[str, Dict[str, str]]:
-    logger.info("=== LOCAL parse_bom_xml CALLED (NOT RAG SERVICE) ===")
-    logger.info("Starting to parse XML...")
-    components = {}
-    
-    try:
-        tree = ET.ElementTree(ET.fromstring(xml_content))
-        root = tree.getroot()
-        logger.info(f"XML root tag: {root.tag}")
-        
-        # First, try to dump the XML structure for debugging
-        try:
-            logger.debug(f"XML structure overview:")
-            for child in root:
-                logger.debug(f"L1: {child.tag}")
-                for subchild in child:
-                    logger.debug(f"  L2: {subchild.tag}")
-                    if len(list(subchild)) > 0:
-                        logger.debug(f"    L3 examples: {[sc.tag for sc in list(subchild)[:3]]}")
-        except Exception as e:
-            logger.warning(f"Error while logging XML structure: {str(e)}")
-        
-        # Try multiple known formats
-        
-        # Format 1: <DETAILS><RECORD> structure
-        details = root.find(".//DETAILS")
-        if details is not None:
-            logger.info(f"Found DETAILS element with {len(list(details))} children")
-            records = details.findall("RECORD")
-            logger.info(f"Found {len(records)} RECORD elements")
-            
-            # First pass to collect all components as they are
-            for record in records:
-                ref = record.findtext("REFDES", "").strip()
-                if ref:
-                    components[ref] = {
-                        "CORP-NUM": record.findtext("CORP-NUM", "").strip(),
-                        "DESCRIPTION": record.findtext("DESCRIPTION", "").strip(),
-                        "NUMBER": record.findtext("NUMBER", "").strip(),
-                        "OPT": record.findtext("OPT", "").strip(),
-                        "PACKAGE": record.findtext("PACKAGE", "").strip(),
-                        "PART-NAME": record.findtext("PART-NAME", "").strip(),
-                        "PART-NUM": record.findtext("PART-NUM", "").strip(),
-                        "QTY": record.findtext("QTY", "").strip(),
-                        "REFDES": ref
-                    }
-            logger.info(f"Parsed {len(components)} components with REFDES from RECORD elements")
-            
-            # Second pass to expand multiple references (only if first pass had components)
-            if components:
-                # Check if we need to expand multiple references
-                need_expansion = any(',' in ref or '-' in ref for ref in components.keys())
-                if need_expansion:
-                    logger.info("Found components with multiple reference designators, expanding...")
-                    expanded_components = {}
-                    for ref, comp in components.items():
-                        if ',' in ref or '-' in ref:
-                            # Multiple references in one component
-                            expanded_refs = []
-                            
-                            # Process comma-separated references
-                            for part in ref.split(','):
-                                part = part.strip()
-                                if '-' in part:
-                                    # Handle ranges like R1-R5 or L40-41
-                                    try:
-                                        range_parts = part.split('-')
-                                        if len(range_parts) == 2:
-                                            base, end = range_parts
-                                            
-                                            # Extract prefix and number from base
-                                            prefix = ''.join(c for c in base if not c.isdigit())
-                                            base_num = ''.join(c for c in base if c.isdigit())
-                                            
-                                            # Check if end has prefix or just number
-                                            if any(not c.isdigit() for c in end):
-                                                # End has prefix (e.g., R1-R5)
-                                                expanded_refs.extend([base, end])
-                                            else:
-                                                # End is just number (e.g., L40-41)
-                                                try:
-                                                    start_num = int(base_num)
-                                                    end_num = int(end)
-                                                    expanded_refs.extend([f"{prefix}{i}" for i in range(start_num, end_num + 1)])
-                                                except ValueError:
-                                                    # If parsing fails, add as is
-                                                    expanded_refs.append(part)
-                                    except Exception as e:
-                                        logger.warning(f"Error expanding range '{part}': {str(e)}")
-                                        expanded_refs.append(part)
-                                else:
-                                    expanded_refs.append(part)
-                            
-                            # Create individual entries for each expanded reference
-                            for expanded_ref in expanded_refs:
-                                expanded_components[expanded_ref] = {
-                                    "CORP-NUM": comp["CORP-NUM"],
-                                    "DESCRIPTION": comp["DESCRIPTION"],
-                                    "NUMBER": comp["NUMBER"],
-                                    "OPT": comp["OPT"],
-                                    "PACKAGE": comp["PACKAGE"],
-                                    "PART-NAME": comp["PART-NAME"],
-                                    "PART-NUM": comp["PART-NUM"],
-                                    "QTY": comp["QTY"],
-                                    "REFDES": expanded_ref
-                                }
-                        else:
-                            # Single reference, add as is
-                            expanded_components[ref] = comp
-                    
-                    logger.info(f"After expansion: {len(expanded_components)} individual components")
-                    components = expanded_components
-        
-            if components:
-                return components
-    except Exception as e:
-        logger.error(f"Error in main XML parsing: {str(e)}")
-        traceback.print_exc()
-    
-    # Format 2: <Component> structure
+class SpooledUpload(NamedTuple):
+    path: str
+    sha256: str
+
+@asynccontextmanager
+async def spooled_uploads(*uploads: UploadFile):
+    """Copy uploads chunk by chunk to temporary files a worker process can read, hashing
+    them on the way; yields a SpooledUpload per upload"""
+    paths, spooled_files = [], []
     try:
-        logger.info("Trying Component structure as fallback...")
-        for comp in root.findall(".//Component"):
-            ref = comp.findtext("Reference", "").strip()
-            if ref:
-                components[ref] = {
-                    "CORP-NUM": comp.findtext("Manufacturer", "").strip(),
-                    "DESCRIPTION": comp.findtext("Description", "").strip(),
-                    "NUMBER": comp.findtext("NUMBER", "").strip(),
-                    "OPT": "",
-                    "PACKAGE": "",
-                    "PART-NAME": "",
-                    "PART-NUM": comp.findtext("PartNumber", "").strip(),
-                    "QTY": comp.findtext("Value", "").strip(),
-                    "REFDES": ref
-                }
-        logger.info(f"Parsed {len(components)} components with Reference from Component elements")
-        if components:
-            return components
-    except Exception as e:
-        logger.error(f"Error in Component fallback: {str(e)}")
-        traceback.print_exc()
-    
-    # Format 3: Try to parse parts directly from any element with needed attributes
+        for upload in uploads:
+            digest = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(suffix=".xml", delete=False) as spooled:
+                paths.append(spooled.name)
+                async for chunk in read_upload(upload):
+                    digest.update(chunk)
+                    spooled.write(chunk)
+            spooled_files.append(SpooledUpload(spooled.name, digest.hexdigest()))
+        yield spooled_files
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+async def parsed_upload(spooled: SpooledUpload) -> bytes:
+    """Serialized ParsedBom of a spooled upload, parsed in a worker unless cached"""
+    return await parse_cache.get_or_parse(
+        spooled.sha256, lambda: parse_pool.run("parse", parse_bom_path, spooled.path)
+    )
+
+async def stored_revision(revision_id: str) -> bytes:
+    """Serialized ParsedBom of a stored revision (read from disk unless cached)"""
+    if not bom_store.enabled:
+        raise HTTPException(status_code=503, detail="BOM store is disabled (RAG_DATA_DIR is not set)")
     try:
-        logger.info("Trying generic XML element search as final fallback...")
-        # Lookup different possible tag names and patterns
-        possible_component_tags = ["part", "component", "item", "element", "row", "component_info"]
-        possible_ref_tags = ["Reference", "Ref", "RefDes", "REFDES", "Designator", "RefDesignator", "id", "name"]
-        
-        for tag in possible_component_tags:
-            components_found = 0
-            for comp in root.findall(f".//{tag}"):
-                # Try different ways to get reference designator
-                ref = None
-                # Method 1: Check for child elements with reference info
-                for ref_tag in possible_ref_tags:
-                    if comp.findtext(ref_tag):
-                        ref = comp.findtext(ref_tag).strip()
-                        break
-                
-                # Method 2: Check for attributes
-                if not ref:
-                    for ref_tag in possible_ref_tags:
-                        if ref_tag.lower() in [k.lower() for k in comp.attrib.keys()]:
-                            for k, v in comp.attrib.items():
-                                if k.lower() == ref_tag.lower():
-                                    ref = v.strip()
-                                    break
-                            if ref:
-                                break
-                
-                if ref:
-                    # Found a reference, now extract other properties
-                    comp_data = {
-                        "CORP-NUM": "",
-                        "DESCRIPTION": "",
-                        "NUMBER": "",
-                        "OPT": "",
-                        "PACKAGE": "",
-                        "PART-NAME": "",
-                        "PART-NUM": "",
-                        "QTY": "1",  # Default quantity
-                        "REFDES": ref
-                    }
-                    
-                    # Extract all attributes and child elements
-                    for key, value in comp.attrib.items():
-                        if key.lower() in ["partnumber", "part", "part-num", "pn", "part-number"]:
-                            comp_data["PART-NUM"] = value.strip()
-                        elif key.lower() in ["description", "desc", "descr"]:
-                            comp_data["DESCRIPTION"] = value.strip()
-                        elif key.lower() in ["quantity", "qty", "count"]:
-                            comp_data["QTY"] = value.strip()
-                        elif key.lower() in ["package", "footprint", "pkgtype"]:
-                            comp_data["PACKAGE"] = value.strip()
-                    
-                    # Also check for child elements
-                    for child in comp:
-                        tag_name = child.tag.lower()
-                        if tag_name in ["partnumber", "part", "part-num", "pn", "part-number"]:
-                            comp_data["PART-NUM"] = child.text.strip() if child.text else ""
-                        elif tag_name in ["description", "desc", "descr"]:
-                            comp_data["DESCRIPTION"] = child.text.strip() if child.text else ""
-                        elif tag_name in ["quantity", "qty", "count"]:
-                            comp_data["QTY"] = child.text.strip() if child.text else ""
-                        elif tag_name in ["package", "footprint", "pkgtype"]:
-                            comp_data["PACKAGE"] = child.text.strip() if child.text else ""
-                    
-                    components[ref] = comp_data
-                    components_found += 1
-            
-            if components_found > 0:
-                logger.info(f"Found {components_found} components using generic tag '{tag}'")
-                break
-        
-        if components:
-            return components
-    except Exception as e:
-        logger.error(f"Error in generic XML search: {str(e)}")
-        traceback.print_exc()
-    
-    logger.warning("All XML parsing methods failed. Returning empty component list.")
-    return components
+        return await parse_cache.get_or_parse(
+            revision_id, lambda: parse_pool.run("load_revision", load_revision, bom_store, revision_id)
+        )
+    except RevisionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-def format_part(part):
-    # Ensure all fields are present and not None
-    formatted = {
-        "REFDES": part.get("REFDES", "") or part.get("Reference", "") or part.get("RefDes", "") or part.get("reference", ""),
-        "PartNumber": part.get("PART-NUM", "") or part.get("PartNumber", "") or part.get("Part Number", "") or part.get("partNumber", ""),
-        "QTY": part.get("QTY", "") or part.get("Quantity", "") or part.get("quantity", "") or part.get("Value", "") or part.get("value", ""),
-        "OPT": part.get("OPT", ""),
-        "DESCRIPTION": part.get("DESCRIPTION", "") or part.get("Description", "") or part.get("description", ""),
-        "PACKAGE": part.get("PACKAGE", "") or part.get("Package", "") or part.get("Footprint", "") or part.get("footprint", ""),
-        "PARTNAME": part.get("PART-NAME", "") or part.get("PartName", "") or part.get("partName", ""),
-        "NUMBER": part.get("NUMBER", "") or part.get("Number", "") or part.get("number", "")
-    }
-    
-    # Add debug logging for the first component
-    if part.get("REFDES", "").startswith("R1") or part.get("Reference", "").startswith("R1"):
-        logger.debug(f"Original part data: {part}")
-        logger.debug(f"Formatted part data: {formatted}")
-        
-    return formatted
+def parse_pool_busy(e: ParsePoolFullError) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"BOM parser busy: {e}", headers={"Retry-After": "1"})
 
 @app.post("/compare-bom")
-async def compare_bom(old_file: UploadFile = File(...), new_file: UploadFile = File(...)) -> Any:
+async def compare_bom(
+    old_file: UploadFile = File(...),
+    new_file: UploadFile = File(...),
+    group: bool = Form(False)  # One entry per identical part with compressed REFDES ranges (C1-C40,C45)
+) -> Any:
     logger.info(f"=== BOM COMPARISON ENDPOINT CALLED ===")
     logger.info(f"Received BOM comparison request: {old_file.filename} vs {new_file.filename}")
     try:
-        old_xml = (await old_file.read()).decode()
-        new_xml = (await new_file.read()).decode()
-        logger.info(f"Old XML length: {len(old_xml)}, New XML length: {len(new_xml)}")
-        
-        logger.info("Calling local parse_bom_xml for old file...")
-        old_components = parse_bom_xml(old_xml)
-        logger.info("Calling local parse_bom_xml for new file...")
-        new_components = parse_bom_xml(new_xml)
-        logger.info(f"Parsed components - Old: {len(old_components)}, New: {len(new_components)}")
-
-        added = []
-        removed = []
-        changed = []
-
-        def key_fields(part):
-            return (
-                part.get("REFDES", ""),
-                part.get("QTY", ""),
-                part.get("CORP-NUM", ""),
-                part.get("PART-NUM", "")
-            )
-
-        for ref, new_comp in new_components.items():
-            if ref not in old_components:
-                added.append(format_part(new_comp))
-            else:
-                old_comp = old_components[ref]
-                if key_fields(old_comp) != key_fields(new_comp):
-                    changed.append({
-                        "Reference": ref,
-                        "Original": format_part(old_comp),
-                        "Modified": format_part(new_comp)
-                    })
-        for ref, old_comp in old_components.items():
-            if ref not in new_components:
-                removed.append(format_part(old_comp))
-
-        result = {
-            "added": added,
-            "removed": removed,
-            "changed": changed,
-            "addedComponents": added,
-            "deletedComponents": removed,
-            "changedComponents": changed
-        }
-        print(f"Comparison result: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
-        return result
+        # Parsed (unless cached) and diffed in worker processes; the JSON body comes back ready to send
+        async with spooled_uploads(old_file, new_file) as (old_spooled, new_spooled):
+            old_parsed, new_parsed = await asyncio.gather(parsed_upload(old_spooled), parsed_upload(new_spooled))
+        body = await parse_pool.run("compare", compare_parsed, old_parsed, new_parsed, group)
+        return Response(content=body, media_type="application/json")
+    except ParsePoolFullError as e:
+        raise parse_pool_busy(e)
     except Exception as e:
-        print(f"Error during BOM comparison: {str(e)}")
+        logger.exception(f"Error during BOM comparison: {e}")
         return JSONResponse(status_code=400, content={"error": str(e)})
 
 # AI Chat endpoints
@@ -534,6 +366,14 @@ async def get_ollama_models(ollama_url: str = "http://localhost:11434"):
 @app.get("/api/ollama/status")
 async def check_ollama_status(ollama_url: str = "http://localhost:11434"):
     """Check if Ollama server is running"""
+    # The server the RAG service uses is probed in the background; answer from that cache
+    prober = memory_rag_service.health_prober
+    if ollama_url.rstrip("/") == prober.ollama_url.rstrip("/") and prober.healthy is not None:
+        status = {"status": "connected" if prober.healthy else "disconnected", "cached": True,
+                  "circuit": prober.breaker.state}
+        if prober.last_error:
+            status["error"] = prober.last_error
+        return status
     try:
         timeout = aiohttp.ClientTimeout(total=10, connect=5)  # 10s total, 5s connect timeout
         async with aiohttp.ClientSession(timeout=timeout) as session:
@@ -587,128 +427,254 @@ async def test_ollama_connection(ollama_url: str = "http://localhost:11434"):
             "error": f"Unexpected error: {str(e)}"
         }
 
+async def add_parsed_to_knowledge(parsed: bytes, source_name: str, create_embeddings: bool) -> Dict[str, Any]:
+    """Knowledge-base components of a parsed BOM, with embeddings created by a background task"""
+    bom_data = knowledge_from_rows(await parse_pool.run("knowledge", knowledge_of_parsed, parsed))
+    component_count = len(bom_data.get('components', []))
+    
+    if not create_embeddings:
+        # Fast path: Just parse and return without creating embeddings
+        return {
+            "status": "success",
+            "message": f"Parsed {component_count} components (no embeddings created)",
+            "source": source_name,
+            "component_count": component_count,
+            "embeddings_created": False
+        }
+    
+    # Queue a persisted background task for embedding creation
+    task_status = task_manager.submit(
+        "embedding_creation",
+        {"bom_data": bom_data, "source_name": source_name},
+        total_items=component_count
+    )
+    task_id = task_status.task_id
+    
+    return {
+        "status": "success", 
+        "message": f"Parsed {component_count} components, creating embeddings in background",
+        "source": source_name,
+        "component_count": component_count,
+        "embeddings_created": False,
+        "background_task_id": task_id,
+        "embeddings_status": "processing"
+    }
+
 # RAG Endpoints
 @app.post("/api/rag/add-bom")
 async def add_bom_to_knowledge(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     source_name: str = Form(...),
     create_embeddings: bool = Form(True)  # Optional parameter to control embedding creation
 ):
     """Add BOM file to knowledge base with optional async embedding creation"""
     try:
-        content = await file.read()
-        content_str = content.decode('utf-8')
-        
-        # Parse the XML content immediately (fast)
-        bom_data = memory_rag_service.parse_xml_bom(content_str)
-        component_count = len(bom_data.get('components', []))
+        # Parse the XML content immediately (fast), in a worker process unless cached
+        async with spooled_uploads(file) as (spooled,):
+            parsed = await parsed_upload(spooled)
+        return await add_parsed_to_knowledge(parsed, source_name, create_embeddings)
+    except ParsePoolFullError as e:
+        raise parse_pool_busy(e)
+    except Exception as e:
+        logger.error(f"Failed to add BOM to knowledge base: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to add BOM: {str(e)}")
+
+@app.post("/api/rag/add-revision")
+async def add_revision_to_knowledge(request: AddRevisionRequest):
+    """Add a stored BOM revision to the knowledge base (no upload, no parse)"""
+    try:
+        parsed = await stored_revision(request.revision_id)
+        return await add_parsed_to_knowledge(parsed, request.source_name, request.create_embeddings)
+    except HTTPException:
+        raise
+    except ParsePoolFullError as e:
+        raise parse_pool_busy(e)
+    except Exception as e:
+        logger.error(f"Failed to add BOM revision to knowledge base: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to add BOM revision: {str(e)}")
+
+def embeddings_paused(e: EmbeddingUnavailableError) -> TaskDeferred:
+    """Pause an ingestion task until the Ollama circuit lets a trial call through"""
+    return TaskDeferred(str(e), memory_rag_service.health_prober.breaker.reset_timeout)
+
+async def create_embeddings_background(task_status: TaskStatus) -> str:
+    """Background task to create embeddings for BOM components (resumes after the last committed batch)"""
+    task_id = task_status.task_id
+    bom_data = task_status.payload["bom_data"]
+    components = bom_data.get("components", [])
+    task_status.message = "Creating embeddings for components..."
+    
+    # Add components to vector database with progress tracking
+    try:
+        await memory_rag_service.add_bom_to_knowledge_with_progress(
+            bom_data, 
+            task_status.payload["source_name"],
+            progress_callback=lambda current, total: update_task_progress(task_id, current, total),
+            resume_from=task_status.checkpoint,
+            checkpoint_callback=lambda committed: task_manager.set_checkpoint(task_id, committed)
+        )
+    except EmbeddingUnavailableError as e:
+        raise embeddings_paused(e)
+    return f"Successfully created embeddings for {len(components)} components"
+
+def update_task_progress(task_id: str, current: int, total: int, files: Optional[Dict[str, List[int]]] = None):
+    """Update progress for a background task (files: source -> [components done, components total])"""
+    details = None
+    if files is not None:
+        details = {"files": {source: {"done": done, "total": total_count} for source, (done, total_count) in files.items()}}
+    task_manager.update_progress(task_id, current, total, details=details)
+
+@app.post("/api/rag/add-boms")
+async def add_boms_to_knowledge(files: List[UploadFile] = File(...)):
+    """Add many BOM files (or one zip/tar of them) through one background task
+
+    Files are parsed in parallel worker processes; all components then go through one
+    deduplicating embedding pipeline. Each file's name is its source name.
+    """
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # Uploads are spooled to disk and unpacked in a worker within BULK_LIMITS
+            members, rejected, budget = [], [], BULK_LIMITS
+            async with spooled_uploads(*files) as spooled_files:
+                for upload, spooled in zip(files, spooled_files):
+                    unpacked, errors, budget = await parse_pool.run(
+                        "bulk_unpack", unpack_bom_upload, spooled.path, upload.filename, directory, budget, wait=True
+                    )
+                    members.extend(unpacked)
+                    rejected.extend(errors)
+            if not members and not rejected:
+                raise HTTPException(status_code=400, detail="No XML files in upload")
+            
+            names = [member.source_name for member in members]
+            if len(set(names)) != len(names):
+                raise HTTPException(status_code=400, detail="Duplicate file names in upload")
+            
+            # Members are parsed at most max_workers at a time so a bulk upload leaves room for requests
+            in_flight = asyncio.Semaphore(parse_pool.max_workers)
+
+            async def parse_member(member: BulkMember) -> bytes:
+                async def parse() -> bytes:
+                    async with in_flight:
+                        return await parse_pool.run("bulk_parse", parse_bom_member, member.path, wait=True)
+                return await parse_cache.get_or_parse(member.sha256, parse)
+
+            blobs = await asyncio.gather(*[parse_member(member) for member in members])
+        rows = await parse_pool.map("bulk_knowledge", knowledge_of_parsed, [(blob,) for blob in blobs])
+        parsed = [(source_name, knowledge_from_rows(file_rows)) for source_name, file_rows in zip(names, rows)]
         
-        if not create_embeddings:
-            # Fast path: Just parse and return without creating embeddings
+        file_results = [
+            {"source": source_name, "component_count": len(bom_data.get("components", []))}
+            for source_name, bom_data in parsed
+        ] + [{**error, "component_count": 0} for error in rejected]
+        boms = [[source_name, bom_data] for source_name, bom_data in parsed if bom_data.get("components")]
+        component_count = sum(result["component_count"] for result in file_results)
+        if not boms:
             return {
-                "status": "success",
-                "message": f"Parsed {component_count} components (no embeddings created)",
-                "source": source_name,
-                "component_count": component_count,
-                "embeddings_created": False
+                "status": "error",
+                "message": "No components found in any file",
+                "files": file_results,
+                "component_count": 0
             }
         
-        # Create a background task for embedding creation
-        task_id = str(uuid.uuid4())
-        task_status = TaskStatus(task_id, "embedding_creation", component_count)
-        background_tasks_status[task_id] = task_status
-        
-        # Start background embedding creation
-        background_tasks.add_task(
-            create_embeddings_background,
-            task_id,
-            bom_data,
-            source_name
+        task_status = task_manager.submit(
+            "bulk_embedding_creation",
+            {"boms": boms},
+            total_items=component_count
         )
-        
         return {
-            "status": "success", 
-            "message": f"Parsed {component_count} components, creating embeddings in background",
-            "source": source_name,
+            "status": "success",
+            "message": f"Parsed {component_count} components from {len(boms)} files, creating embeddings in background",
+            "files": file_results,
             "component_count": component_count,
-            "embeddings_created": False,
-            "background_task_id": task_id,
+            "background_task_id": task_status.task_id,
             "embeddings_status": "processing"
         }
+    except HTTPException:
+        raise
+    except ArchiveTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        logger.error(f"Failed to add BOM to knowledge base: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to add BOM: {str(e)}")
+        logger.error(f"Failed to add BOMs to knowledge base: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to add BOMs: {str(e)}")
 
-async def create_embeddings_background(task_id: str, bom_data: Dict[str, Any], source_name: str):
-    """Background task to create embeddings for BOM components"""
-    task_status = background_tasks_status.get(task_id)
-    if not task_status:
-        return
+async def create_bulk_embeddings_background(task_status: TaskStatus) -> str:
+    """Background task embedding the components of several BOMs in one pass"""
+    task_id = task_status.task_id
+    boms = [(source_name, bom_data) for source_name, bom_data in task_status.payload["boms"]]
+    task_status.message = f"Creating embeddings for {len(boms)} files..."
     
     try:
-        task_status.message = "Creating embeddings for components..."
-        components = bom_data.get("components", [])
-        
-        # Add components to vector database with progress tracking
-        await memory_rag_service.add_bom_to_knowledge_with_progress(
-            bom_data, 
-            source_name,
-            progress_callback=lambda current, total: update_task_progress(task_id, current, total)
+        await memory_rag_service.add_boms_to_knowledge_with_progress(
+            boms,
+            progress_callback=lambda current, total, files: update_task_progress(task_id, current, total, files),
+            resume_from=task_status.checkpoint,
+            checkpoint_callback=lambda committed: task_manager.set_checkpoint(task_id, committed)
         )
-        
-        task_status.status = "completed"
-        task_status.progress = 100
-        task_status.message = f"Successfully created embeddings for {len(components)} components"
-        task_status.completed_at = datetime.now()
-        
-    except Exception as e:
-        task_status.status = "failed"
-        task_status.error = str(e)
-        task_status.message = f"Failed to create embeddings: {str(e)}"
-        task_status.completed_at = datetime.now()
-        logger.error(f"Background embedding task {task_id} failed: {e}")
-
-def update_task_progress(task_id: str, current: int, total: int):
-    """Update progress for a background task"""
-    task_status = background_tasks_status.get(task_id)
-    if task_status:
-        task_status.progress = int((current / total) * 100) if total > 0 else 0
-        task_status.message = f"Processing component {current} of {total}"
+    except EmbeddingUnavailableError as e:
+        raise embeddings_paused(e)
+    return f"Successfully created embeddings for {task_status.total_items} components from {len(boms)} files"
 
 @app.get("/api/rag/task-status/{task_id}")
 async def get_task_status(task_id: str):
     """Get status of a background task"""
-    task_status = background_tasks_status.get(task_id)
+    task_status = task_manager.get(task_id)
     if not task_status:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return {
-        "task_id": task_id,
-        "task_type": task_status.task_type,
-        "status": task_status.status,
-        "progress": task_status.progress,
-        "total_items": task_status.total_items,
-        "message": task_status.message,
-        "started_at": task_status.started_at.isoformat(),
-        "completed_at": task_status.completed_at.isoformat() if task_status.completed_at else None,
-        "error": task_status.error
-    }
+    return task_status.to_dict()
+
+@app.get("/api/rag/task-status/{task_id}/stream")
+async def stream_task_status(task_id: str):
+    """Server-sent events for a background task: throttled progress, then completed or failed"""
+    task_status = task_manager.get(task_id)
+    if not task_status:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    # Subscribe before taking the snapshot so a completion in between is not missed
+    events = task_manager.events.subscribe(task_id)
+    
+    def format_event(event: str, data: Dict[str, Any]) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    async def event_stream():
+        try:
+            snapshot = task_status.to_dict()
+            yield format_event(task_status.status if task_status.finished else "progress", snapshot)
+            if task_status.finished:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=TASK_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event["event"], event["data"])
+                if event["event"] in ("completed", "failed"):
+                    return
+        finally:
+            task_manager.events.unsubscribe(task_id, events)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/rag/active-tasks")
 async def get_active_tasks():
-    """Get all active background tasks"""
-    active_tasks = []
-    for task_id, task_status in background_tasks_status.items():
-        if task_status.status == "running":
-            active_tasks.append({
-                "task_id": task_id,
-                "task_type": task_status.task_type,
-                "progress": task_status.progress,
-                "message": task_status.message,
-                "started_at": task_status.started_at.isoformat()
-            })
-    return {"active_tasks": active_tasks}
+    """Get all queued and running background tasks"""
+    active_tasks = [
+        {
+            "task_id": task_status.task_id,
+            "task_type": task_status.task_type,
+            "status": task_status.status,
+            "progress": task_status.progress,
+            "message": task_status.message,
+            "started_at": task_status.started_at.isoformat()
+        }
+        for task_status in task_manager.unfinished()
+    ]
+    return {"active_tasks": active_tasks, **task_manager.get_stats()}
 
 @app.get("/api/rag/status")
 async def get_rag_status():
@@ -736,7 +702,8 @@ async def rag_health():
             "status": "ok", 
             "message": "Memory RAG service initialized",
             "ollama_url": memory_rag_service.ollama_url,
-            "embedding_model": memory_rag_service.embedding_model
+            "embedding_model": memory_rag_service.embedding_model,
+            "embedding_service": memory_rag_service.health_prober.get_stats()
         }
     except Exception as e:
         return {"status": "error", "error": str(e)}
@@ -746,12 +713,16 @@ async def query_knowledge(request: dict):
     """Query the RAG knowledge base"""
     query = request.get("query", "")
     n_results = request.get("n_results", 5)
+    where = request.get("where")  # Optional metadata filter, e.g. {"source": "a_new.xml", "PACKAGE": ["0402", "0603"]}
+    mode = request.get("mode", "hybrid")  # hybrid, vector or lexical
     
     if not query.strip():
         return {"results": [], "message": "Empty query"}
+    if mode not in ("hybrid", "vector", "lexical"):
+        raise HTTPException(status_code=400, detail=f"Unknown search mode: {mode}")
     
     try:
-        results = await memory_rag_service.query_similar_components(query, n_results)
+        results = await memory_rag_service.query_similar_components(query, n_results, where=where, mode=mode)
         return results
     except Exception as e:
         logger.error(f"Knowledge query failed: {e}")
@@ -797,28 +768,76 @@ async def clear_knowledge_base():
         logger.error(f"Failed to clear knowledge base: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to clear knowledge base: {str(e)}")
 
+@app.post("/api/rag/snapshot")
+async def save_knowledge_snapshot():
+    """Write the current knowledge base to disk"""
+    try:
+        return await memory_rag_service.save_snapshot()
+    except Exception as e:
+        logger.error(f"Failed to save knowledge base snapshot: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to save snapshot: {str(e)}")
+
 # Fast BOM upload without embeddings (for regular preview/compare)
 @app.post("/api/bom/upload-fast")
 async def upload_bom_fast(file: UploadFile = File(...)):
     """Fast BOM upload that only parses XML without creating embeddings"""
     try:
-        content = await file.read()
-        content_str = content.decode('utf-8')
-        
-        # Just parse the XML (fast)
-        components = parse_bom_xml(content_str)
-        
-        return {
-            "status": "success",
-            "message": f"Parsed {len(components)} components",
-            "filename": file.filename,
-            "component_count": len(components),
-            "components": components
-        }
+        # Just parse the XML (fast), in a worker process unless cached
+        async with spooled_uploads(file) as (spooled,):
+            parsed = await parsed_upload(spooled)
+        body = await parse_pool.run("preview", preview_parsed, parsed, file.filename)
+        return Response(content=body, media_type="application/json")
+    except ParsePoolFullError as e:
+        raise parse_pool_busy(e)
     except Exception as e:
         logger.error(f"Failed to parse BOM: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to parse BOM: {str(e)}")
 
+@app.post("/api/bom/revisions")
+async def upload_bom_revision(file: UploadFile = File(...)):
+    """Store a BOM revision parsed; its id (SHA-256 of the XML) is used to compare it or add it to the knowledge base"""
+    if not bom_store.enabled:
+        raise HTTPException(status_code=503, detail="BOM store is disabled (RAG_DATA_DIR is not set)")
+    try:
+        async with spooled_uploads(file) as (spooled,):
+            parsed = await parsed_upload(spooled)
+            size = os.path.getsize(spooled.path)
+        if spooled.sha256 in bom_store:
+            return {"status": "success", "stored": False, **bom_store.info(spooled.sha256)}
+        info = {"filename": file.filename, "size": size}
+        info = await parse_pool.run("store_revision", store_revision, bom_store, spooled.sha256, parsed, info)
+        return {"status": "success", "stored": True, **info}
+    except ParsePoolFullError as e:
+        raise parse_pool_busy(e)
+    except Exception as e:
+        logger.error(f"Failed to store BOM revision: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to store BOM revision: {str(e)}")
+
+@app.get("/api/bom/revisions")
+async def list_bom_revisions():
+    """Stored BOM revisions, oldest first"""
+    return {"revisions": await asyncio.to_thread(bom_store.list)}
+
+@app.post("/api/bom/revisions/compare")
+async def compare_bom_revisions(request: CompareRevisionsRequest):
+    """/compare-bom for two stored revisions; only the diff runs"""
+    try:
+        old_parsed, new_parsed = await asyncio.gather(stored_revision(request.old_id), stored_revision(request.new_id))
+        body = await parse_pool.run("compare", compare_parsed, old_parsed, new_parsed, request.group)
+        return Response(content=body, media_type="application/json")
+    except HTTPException:
+        raise
+    except ParsePoolFullError as e:
+        raise parse_pool_busy(e)
+    except Exception as e:
+        logger.error(f"Failed to compare BOM revisions: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to compare BOM revisions: {str(e)}")
+
+@app.get("/api/bom/parse-stats")
+async def get_parse_stats():
+    """Parse worker pool occupancy, per-job timing and parse cache counters"""
+    return {**parse_pool.get_stats(), "cache": parse_cache.get_stats()}
+
 # RAG-Enhanced Chat endpoint
 @app.post("/api/chat/rag-completions")
 async def rag_chat_completions(request: ChatRequest):
@@ -835,12 +854,10 @@ async def rag_chat_completions(request: ChatRequest):
         rag_results = []
         if user_message.strip():
             try:
-                query_response = await memory_rag_service.query_similar_components(user_message, 5)
-                if isinstance(query_response, list):
-                    rag_results = query_response
-                elif isinstance(query_response, dict) and 'results' in query_response:
-                    rag_results = query_response['results']
-                logger.info(f"RAG query returned {len(rag_results)} results")
+                # Exact refdes / part number questions skip the embedding round-trip
+                query_response = await memory_rag_service.route_query(user_message, 5)
+                rag_results = query_response['results']
+                logger.info(f"RAG query ({query_response['route']}) returned {len(rag_results)} results")
             except Exception as e:
                 logger.warning(f"RAG query failed, continuing without context: {e}")
         
@@ -907,10 +924,19 @@ You understand BOM structures with fields like:
                     context_parts = []
                     context_parts.append("=== RELEVANT BOM COMPONENTS ===")
                     
-                    for j, result in enumerate(rag_results[:5]):  # Use top 5 results
+                    # Results differing only in REFDES share one entry listing compressed ranges (C1-C40,C45)
+                    grouped_results: Dict[tuple, Dict[str, Any]] = {}
+                    for result in rag_results:  # Top 5 semantic hits or all exact matches
                         metadata = result.get('metadata', {})
+                        refs = metadata.get('REFDES', '')
+                        key = tuple(str(metadata.get(field, '')) for field in PROMPT_COMPONENT_FIELDS)  # source may be a list
+                        group = grouped_results.setdefault(key, {'metadata': metadata, 'refs': []})
+                        group['refs'].extend(refs if isinstance(refs, list) else [refs])
+
+                    for j, group in enumerate(grouped_results.values()):
+                        metadata = group['metadata']
                           # Extract structured component data
-                        refdes = metadata.get('REFDES', '')
+                        refdes = compress_refdes(ref for ref in group['refs'] if ref)
                         part_name = metadata.get('PART-NAME', '')
                         part_num = metadata.get('PART-NUM', '')
                         description = metadata.get('DESCRIPTION', '')
@@ -1075,73 +1101,50 @@ Instructions:
         )
 
 # Component change detection endpoint
+# Stored fields compared between the two sources
+CHANGE_FIELDS = ("PART-NAME", "PART-NUM", "DESCRIPTION", "PACKAGE", "QTY", "OPT")
+
 @app.get("/api/rag/component-changes")
-async def get_component_changes():
+async def get_component_changes(old_source: str = "a_old.xml", new_source: str = "a_new.xml"):
     """Get actual component changes between old and new BOMs"""
     try:
-        # Get all components from both files
-        all_results = await memory_rag_service.query_similar_components("", 1000)  # Get all components
+        # Fetch exactly the components of both sources through the metadata index
+        all_results = memory_rag_service.get_components(where={"source": [old_source, new_source]})
         
-        old_components = {}
-        new_components = {}
-        
-        # Separate components by source file
+        # One table per source sharing a string pool, so the diff compares code columns
+        pool = StringPool()
+        old_table, new_table = BomTable(pool), BomTable(pool)
+        tables = {new_source: new_table, old_source: old_table}  # Same name: all old, as before
         for result in all_results:
             metadata = result.get('metadata', {})
-            refdes = metadata.get('REFDES', '')
-            source = metadata.get('source', '')
-            
-            if not refdes:
-                continue
-                
-            component_data = {
-                'refdes': refdes,
-                'part_name': metadata.get('PART-NAME', ''),
-                'part_num': metadata.get('PART-NUM', ''),
-                'description': metadata.get('DESCRIPTION', ''),
-                'package': metadata.get('PACKAGE', ''),
-                'qty': metadata.get('QTY', ''),
-                'opt': metadata.get('OPT', '')
-            }
-            
-            if source == 'a_old.xml':
-                old_components[refdes] = component_data
-            elif source == 'a_new.xml':
-                new_components[refdes] = component_data
+            table = tables.get(metadata.get('source', ''))
+            if table is not None and metadata.get('REFDES'):
+                table.add(metadata)
         
-        # Find actual changes (same REFDES, different values)
-        changes = []
-        for refdes in old_components:
-            if refdes in new_components:
-                old_comp = old_components[refdes]
-                new_comp = new_components[refdes]
-                
-                # Check if any field is different
-                if (old_comp['part_name'] != new_comp['part_name'] or
-                    old_comp['part_num'] != new_comp['part_num'] or
-                    old_comp['description'] != new_comp['description'] or
-                    old_comp['package'] != new_comp['package'] or
-                    old_comp['qty'] != new_comp['qty'] or
-                    old_comp['opt'] != new_comp['opt']):
-                    
-                    changes.append({
-                        'refdes': refdes,
-                        'old': old_comp,
-                        'new': new_comp,
-                        'changes': []  # Could detail specific field changes
-                    })
-        
-        # Find added components (in new but not old)
-        added = []
-        for refdes in new_components:
-            if refdes not in old_components:
-                added.append(new_components[refdes])
+        def component_data(table: BomTable, row: int) -> Dict[str, str]:
+            return {
+                'refdes': table.refdes[row],
+                'part_name': table.value('PART-NAME', row),
+                'part_num': table.value('PART-NUM', row),
+                'description': table.value('DESCRIPTION', row),
+                'package': table.value('PACKAGE', row),
+                'qty': table.value('QTY', row),
+                'opt': table.value('OPT', row)
+            }
         
-        # Find removed components (in old but not new)
-        removed = []
-        for refdes in old_components:
-            if refdes not in new_components:
-                removed.append(old_components[refdes])
+        # Actual changes: same REFDES, different values
+        diff = diff_tables(old_table, new_table, CHANGE_FIELDS)
+        changes = [
+            {
+                'refdes': new_table.refdes[new_row],
+                'old': component_data(old_table, old_row),
+                'new': component_data(new_table, new_row),
+                'changes': []  # Could detail specific field changes
+            }
+            for old_row, new_row in sorted(zip(diff.changed_old, diff.changed_new))  # In old BOM order
+        ]
+        added = [component_data(new_table, row) for row in diff.added]
+        removed = [component_data(old_table, row) for row in diff.removed]
         
         return {
             "changes": changes,
@@ -3,114 +3,284 @@ RAG Service using in-memory vector database
 Simpler, more reliable alternative to ChromaDB
 """
 import logging
-import xml.etree.ElementTree as ET
-from typing import Dict, List, Any, Optional
+import os
+from collections import Counter
+from typing import Dict, List, Any, Optional, Tuple, Union
+import numpy as np
+from bom_parser import parse_xml_bom
 from memory_vectordb import MemoryVectorDB
+from ivf_index import IVFIndex
+from query_router import classify_query
+from refdes import expand as expand_refdes
+from ollama_client import OllamaEmbeddingClient, OllamaHealthProber
+from embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+# Component metadata fields with inverted indexes for where= filters
+COMPONENT_INDEXED_FIELDS = ("source", "type", "REFDES", "PACKAGE", "PART-NUM", "PART-NAME", "CORP-NUM", "OPT")
+# Fields an identifier token from a question is matched against exactly
+PART_NUMBER_FIELDS = ("PART-NUM", "PART-NAME", "CORP-NUM")
+# Cap on components returned for one exact-match question
+EXACT_RESULT_LIMIT = 50
+# Fields that describe one placement rather than the part; identical parts are stored once
+PLACEMENT_FIELDS = ("REFDES", "QTY")
+
+def _total_qty(members: List[Dict[str, Any]]) -> str:
+    """Sum of member quantities (blank when any of them is not a number)"""
+    try:
+        return str(sum(int(m.get("QTY") or 1) for m in members))
+    except ValueError:
+        return ""
+
+def expand_members(metadata: Dict[str, Any], refdes: Optional[set] = None,
+                   sources: Optional[set] = None) -> List[Dict[str, Any]]:
+    """One metadata dict per (source, refdes) member of a grouped component, optionally only
+    the members with the given refdes / from the given sources
+
+    A member's refdes may be a list such as "R146-148"; it matches when any of its
+    designators is wanted.
+    """
+    members = metadata.get("members")
+    if not members:
+        return [metadata]  # Stored before components were grouped
+    base = {key: value for key, value in metadata.items() if key != "members"}
+    return [
+        {**base, "source": source, "REFDES": ref, "QTY": qty}
+        for source, ref, qty in members
+        if (refdes is None or ref in refdes or not refdes.isdisjoint(expand_refdes(ref)))
+        and (sources is None or source in sources)
+    ]
+
+def _wanted(where: Optional[Dict[str, Any]], field: str) -> Optional[set]:
+    if not where or field not in where:
+        return None
+    wanted = where[field]
+    return set(wanted) if isinstance(wanted, (list, tuple, set)) else {wanted}
+
+def _narrow(wanted: Optional[set], asked: Optional[set]) -> Optional[set]:
+    """Refdes both allowed by the filter and asked about in the query (None: no restriction)"""
+    if wanted is None or asked is None:
+        return asked if wanted is None else wanted
+    return wanted & asked
+
 class MemoryRAGService:
     """RAG service using in-memory vector database"""
     
-    def __init__(self):
-        self.components_db = MemoryVectorDB()
-        self.patterns_db = MemoryVectorDB()
+    def __init__(self, precision: Optional[str] = None, rescore_candidates: Optional[int] = None,
+                 data_dir: Optional[str] = None, ollama_url: Optional[str] = None):
+        # Storage precision (float32, float16 or int8) is configurable per deployment
+        precision = precision or os.getenv("RAG_EMBEDDING_PRECISION", "float32")
+        if rescore_candidates is None:
+            rescore_candidates = int(os.getenv("RAG_RESCORE_CANDIDATES", "0"))
+        
+        # Approximate search for the (large) component store; exact below RAG_ANN_MIN_SIZE rows
+        ann_index = None
+        if os.getenv("RAG_ANN_INDEX", "").lower() == "ivf":
+            ann_index = IVFIndex(
+                n_probe=int(os.getenv("RAG_ANN_N_PROBE", "8")),
+                min_train_size=int(os.getenv("RAG_ANN_MIN_SIZE", "50000"))
+            )
+        
         self.embedding_model = "nomic-embed-text"
-        self.ollama_url = "http://localhost:11434"
+        self.ollama_url = ollama_url or "http://localhost:11434"
+        # One pooled client for both stores; texts are sent to /api/embed in batches.
+        # Ingestion has at most RAG_EMBED_CONCURRENCY requests in flight and always
+        # yields to query embeddings (RAG_EMBED_INTERACTIVE_CONCURRENCY at a time)
+        self.embedding_client = OllamaEmbeddingClient(
+            self.ollama_url, self.embedding_model,
+            batch_size=int(os.getenv("RAG_EMBED_BATCH_SIZE", "64")),
+            max_concurrency=int(os.getenv("RAG_EMBED_CONCURRENCY", "4")),
+            interactive_concurrency=int(os.getenv("RAG_EMBED_INTERACTIVE_CONCURRENCY", "8"))
+        )
+        # Keeps the shared circuit breaker current so status reads never wait on Ollama
+        self.health_prober = OllamaHealthProber(
+            self.ollama_url, interval=float(os.getenv("RAG_OLLAMA_PROBE_INTERVAL", "10"))
+        )
+        # Shared by both stores so a component line is embedded once per model
+        self.embedding_cache = EmbeddingCache(int(os.getenv("RAG_EMBED_CACHE_ENTRIES", "20000")))
+        
+        self.components_db = MemoryVectorDB(self.embedding_model, self.ollama_url,
+                                            precision=precision, rescore_candidates=rescore_candidates,
+                                            ann_index=ann_index, indexed_fields=COMPONENT_INDEXED_FIELDS,
+                                            lexical=True, lexical_fields=("REFDES",),
+                                            embedding_client=self.embedding_client,
+                                            embedding_cache=self.embedding_cache)
+        self.patterns_db = MemoryVectorDB(self.embedding_model, self.ollama_url,
+                                          precision=precision, rescore_candidates=rescore_candidates,
+                                          indexed_fields=("source", "type", "package"),
+                                          embedding_client=self.embedding_client,
+                                          embedding_cache=self.embedding_cache)
+        # Snapshots of both stores live under this directory (empty string disables persistence)
+        self.data_dir = data_dir if data_dir is not None else os.getenv("RAG_DATA_DIR", "rag_data")
         logger.info("Initialized Memory RAG Service")
     
-    def parse_xml_bom(self, xml_content: str) -> Dict[str, Any]:
-        """Parse XML BOM content into structured data"""
-        logger.info("Parsing XML BOM content...")
-        components = []
+    def _snapshot_dirs(self) -> Dict[str, str]:
+        return {
+            "components": os.path.join(self.data_dir, "components"),
+            "patterns": os.path.join(self.data_dir, "patterns")
+        }
+    
+    def open_storage(self) -> bool:
+        """Restore the knowledge base (snapshot + write-ahead log) and keep logging changes"""
+        if not self.data_dir:
+            return False
         
+        dirs = self._snapshot_dirs()
+        # Embeddings outlive the knowledge base: clearing it keeps the cache warm for re-uploads
+        self.embedding_cache.open(os.path.join(self.data_dir, "embedding_cache.sqlite"))
+        self.components_db.open_storage(dirs["components"])
+        self.patterns_db.open_storage(dirs["patterns"])
+        logger.info(f"Restored knowledge base from {self.data_dir}: "
+                    f"{self.components_db.count()} components, {self.patterns_db.count()} patterns")
+        return True
+    
+    async def save_snapshot(self) -> Dict[str, Any]:
+        """Fold the write-ahead logs into fresh snapshots (written off the event loop, one at a time)"""
+        if not self.data_dir:
+            return {"status": "disabled", "message": "RAG_DATA_DIR is not set"}
+        
+        for db in (self.components_db, self.patterns_db):
+            await db.compact()
+        return {
+            "status": "success",
+            "data_dir": self.data_dir,
+            "components": self.components_db.count(),
+            "patterns": self.patterns_db.count()
+        }
+    
+    def start_health_probe(self):
+        """Start probing Ollama in the background (needs a running event loop)"""
+        self.health_prober.start()
+    
+    async def close(self):
+        """Snapshot, flush pending log records and release pooled connections before shutdown"""
+        await self.health_prober.stop()
         try:
-            tree = ET.ElementTree(ET.fromstring(xml_content))
-            root = tree.getroot()
-            
-            # Try different XML structures
-            records = root.findall(".//RECORD")
-            if records:
-                for record in records:
-                    component = {
-                        "REFDES": record.findtext("REFDES", "").strip(),
-                        "PART-NAME": record.findtext("PART-NAME", "").strip(),
-                        "PART-NUM": record.findtext("PART-NUM", "").strip(),
-                        "CORP-NUM": record.findtext("CORP-NUM", "").strip(),
-                        "DESCRIPTION": record.findtext("DESCRIPTION", "").strip(),
-                        "PACKAGE": record.findtext("PACKAGE", "").strip(),
-                        "QTY": record.findtext("QTY", "").strip(),
-                        "OPT": record.findtext("OPT", "").strip(),
-                    }
-                    if component["REFDES"]:  # Only add if has reference
-                        components.append(component)
-            
-            logger.info(f"Parsed {len(components)} components from XML")
-            return {
-                "components": components,
-                "total_count": len(components)
-            }
-            
+            # The next start then maps every row instead of replaying the log
+            await self.save_snapshot()
         except Exception as e:
-            logger.error(f"Error parsing XML BOM: {e}")
-            return {"components": [], "total_count": 0}
+            logger.error(f"Snapshot on shutdown failed, changes stay in the write-ahead log: {e}")
+        self.components_db.close()
+        self.patterns_db.close()
+        self.embedding_cache.close()
+        await self.embedding_client.close()
+    
+    def parse_xml_bom(self, xml_content: Union[str, bytes]) -> Dict[str, Any]:
+        """Parse XML BOM content into structured data"""
+        return parse_xml_bom(xml_content)
     
     async def add_bom_to_knowledge(self, bom_data: Dict[str, Any], source_name: str):
         """Add BOM components to knowledge base"""
         await self.add_bom_to_knowledge_with_progress(bom_data, source_name)
     
-    async def add_bom_to_knowledge_with_progress(self, bom_data: Dict[str, Any], source_name: str, progress_callback=None):
-        """Add BOM components to knowledge base with progress tracking"""
-        components = bom_data.get("components", [])
-        
-        if not components:
+    async def add_bom_to_knowledge_with_progress(self, bom_data: Dict[str, Any], source_name: str, progress_callback=None,
+                                                 resume_from: int = 0, checkpoint_callback=None):
+        """Add BOM components to knowledge base with progress tracking
+
+        resume_from: unique parts already committed by an interrupted run (they are skipped)
+        checkpoint_callback: called with the number of committed unique parts after every batch
+        """
+        file_progress = None
+        if progress_callback:
+            file_progress = lambda current, total, files: progress_callback(current, total)
+        await self.add_boms_to_knowledge_with_progress([(source_name, bom_data)], file_progress,
+                                                       resume_from, checkpoint_callback)
+    
+    async def add_boms_to_knowledge_with_progress(self, boms: List[Tuple[str, Dict[str, Any]]], progress_callback=None,
+                                                  resume_from: int = 0, checkpoint_callback=None):
+        """Add several BOMs through one deduplicating embedding pipeline
+
+        Identical parts are grouped across all files, so a part shared by many revisions is
+        embedded and stored once. progress_callback(current, total, files) reports components,
+        with files mapping each source to [components done, components total].
+        """
+        boms = [(source_name, bom_data.get("components", [])) for source_name, bom_data in boms]
+        components_total = sum(len(components) for _, components in boms)
+        if not components_total:
             logger.warning("No components to add to knowledge base")
             return
         
-        logger.info(f"Processing {len(components)} components from {source_name}")
-          # Add components to vector database with progress tracking
-        documents = []
-        for i, component in enumerate(components):
-            # Create searchable content
-            content_parts = []
-            for key, value in component.items():
-                if value and value.strip():
-                    content_parts.append(f"{key}: {value}")
-            
-            content = " | ".join(content_parts)
-            
-            metadata = {
-                "source": source_name,
-                "type": "component",
-                **component
-            }
-            
-            # Debug logging for C999
-            refdes = component.get("REFDES", "")
-            if refdes == "C999":
-                logger.info(f"Processing C999 for embedding: content='{content}', metadata={metadata}")
-            
-            documents.append({
-                "content": content,
-                "metadata": metadata
-            })
-            
-            # Report progress every 10 components
-            if progress_callback and (i + 1) % 10 == 0:
-                progress_callback(i + 1, len(components))
+        sources = ", ".join(source_name for source_name, _ in boms)
+        logger.info(f"Processing {components_total} components from {sources}")
+        documents = self._group_components(boms)
+        logger.info(f"Grouped {components_total} components into {len(documents)} unique parts")
+        
+        # Progress is reported in components, not in stored (grouped) documents
+        files = {source_name: [0, len(components)] for source_name, components in boms}
+        member_counts = [Counter(source for source, _, _ in doc["metadata"]["members"]) for doc in documents]
+        reported = 0  # Documents already counted into files
         
-        # Add all documents (this will create embeddings)
-        doc_ids = await self.components_db.add_documents_with_progress(documents, progress_callback)
-        logger.info(f"Added {len(doc_ids)} components to knowledge base")
+        def group_progress(current: int, total: int):
+            # Called after each batch is committed to the write-ahead log
+            nonlocal reported
+            done = resume_from + current
+            if checkpoint_callback:
+                checkpoint_callback(done)
+            for counts in member_counts[reported:done]:
+                for source, count in counts.items():
+                    files[source][0] += count
+            reported = done
+            if progress_callback:
+                progress_callback(sum(done_count for done_count, _ in files.values()), components_total, files)
+        
+        if resume_from:
+            logger.info(f"Resuming {sources} after {resume_from} of {len(documents)} unique parts")
+            group_progress(0, len(documents))
+        # Add all documents (this will create embeddings); progress is reported per embedding batch
+        doc_ids = await self.components_db.add_documents_with_progress(documents[resume_from:], group_progress)
+        logger.info(f"Added {len(doc_ids)} unique parts ({components_total} components) to knowledge base")
         
         # Report completion
         if progress_callback:
-            progress_callback(len(components), len(components))
+            progress_callback(components_total, components_total, files)
           # Generate some design patterns (optional, in background)
-        try:
-            await self._generate_design_patterns(components, source_name)
-        except Exception as e:
-            logger.warning(f"Failed to generate design patterns: {e}")
+        for source_name, components in boms:
+            try:
+                await self._generate_design_patterns(components, source_name)
+            except Exception as e:
+                logger.warning(f"Failed to generate design patterns: {e}")
+    
+    def _group_components(self, boms: List[Tuple[str, List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """Collapse components that differ only in placement fields into one document each
+
+        The embedded content leaves out REFDES and QTY, so every identical part is embedded
+        and stored once; REFDES keeps the designators (lists such as "R146-148" expanded)
+        for the hash and BM25 indexes and
+        members holds the (source, refdes, qty) postings used to expand results. source is
+        a list when the part occurs in several of the given BOMs.
+        """
+        groups: Dict[tuple, List[Tuple[str, Dict[str, Any]]]] = {}
+        for source_name, components in boms:
+            for component in components:
+                key = tuple((field, value) for field, value in component.items() if field not in PLACEMENT_FIELDS)
+                groups.setdefault(key, []).append((source_name, component))
+        
+        documents = []
+        for key, members in groups.items():
+            content = " | ".join(f"{field}: {value}" for field, value in key if value and value.strip())
+            sources = list(dict.fromkeys(source_name for source_name, _ in members))
+            metadata = {
+                "source": sources[0] if len(sources) == 1 else sources,
+                "type": "component",
+                **dict(key),
+                "REFDES": list(dict.fromkeys(ref for _, m in members for ref in expand_refdes(m.get("REFDES", "")))),
+                "QTY": _total_qty([m for _, m in members]),
+                "members": [[source_name, m.get("REFDES", ""), m.get("QTY", "")] for source_name, m in members]
+            }
+            documents.append({"content": content, "metadata": metadata})
+        return documents
+    
+    @staticmethod
+    def _expand_result(doc: Dict[str, Any], similarity: float, refdes: Optional[set] = None,
+                       sources: Optional[set] = None) -> List[Dict[str, Any]]:
+        """Per-refdes results for a grouped document"""
+        if "members" not in doc["metadata"]:
+            return [{"content": doc["content"], "metadata": doc["metadata"], "similarity": similarity}]
+        return [
+            {"content": f"REFDES: {metadata['REFDES']} | {doc['content']}", "metadata": metadata, "similarity": similarity}
+            for metadata in expand_members(doc["metadata"], refdes, sources)
+        ]
     
     async def _generate_design_patterns(self, components: List[Dict], source_name: str):
         """Generate design patterns from components"""
@@ -143,16 +313,102 @@ class MemoryRAGService:
             await self.patterns_db.add_documents(patterns)
             logger.info(f"Generated {len(patterns)} design patterns")
     
-    async def query_similar_components(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
-        """Query for similar components"""
-        results = await self.components_db.search(query, n_results)
+    async def query_similar_components(self, query: str, n_results: int = 5,
+                                       where: Optional[Dict[str, Any]] = None,
+                                       mode: str = "hybrid", expand: bool = True) -> List[Dict[str, Any]]:
+        """Query for similar components, optionally filtered by metadata (e.g. {"source": "a_new.xml"})
+
+        mode: "hybrid" (BM25 + embeddings), "vector" or "lexical" (no embedding call)
+        expand: one result per refdes instead of one per unique part (n_results counts unique parts)
+
+        Parts named by refdes or part number in the query come first, from the hash index
+        (designators are not embedded, so neither retriever would rank them)
+        """
+        exact = self._exact_lookup(query)["rows"]
+        if exact and where:
+            allowed = set(self.components_db.filter_rows(where).tolist())
+            exact = {row: wanted for row, wanted in exact.items() if row in allowed}
+        rows = list(exact)[:n_results]
+        results = [{**doc, "similarity": 1.0} for doc in self.components_db.get_documents_by_rows(rows)]
+        asked = {result["id"]: exact[row] for row, result in zip(rows, results)}
+        if len(results) < n_results:
+            ranked = await self.components_db.search(query, n_results, where=where, mode=mode)
+            results += [result for result in ranked if result["id"] not in asked][:n_results - len(results)]
+        
+        if not expand:
+            return [
+                {
+                    "content": result["content"],
+                    "metadata": result["metadata"],
+                    "similarity": result["similarity"]
+                }
+                for result in results
+            ]
+        refdes, sources = _wanted(where, "REFDES"), _wanted(where, "source")
         return [
-            {
-                "content": result["content"],
-                "metadata": result["metadata"],
-                "similarity": result["similarity"]
-            }
-            for result in results
+            item for result in results
+            for item in self._expand_result(result, result["similarity"],
+                                            _narrow(refdes, asked.get(result["id"])), sources)
+        ]
+    
+    def _part_number_rows(self, tokens: List[str]) -> np.ndarray:
+        """Rows whose part number fields equal one of the tokens (as written or upper-cased)"""
+        candidates = list({token for t in tokens for token in (t, t.upper())})
+        hits = [self.components_db.filter_rows({field: candidates}) for field in PART_NUMBER_FIELDS]
+        return np.unique(np.concatenate(hits))
+    
+    def _exact_lookup(self, query: str) -> Dict[str, Any]:
+        """Resolve refdes / part number tokens through the metadata hash index
+
+        rows maps each matched row to the refdes wanted from it (None: all members)
+        """
+        routed = classify_query(query)
+        if not routed.has_identifiers:
+            return {"route": "semantic", "rows": {}}
+        
+        db = self.components_db
+        route = None
+        rows: Dict[int, Optional[set]] = {}
+        # Refdes-looking tokens such as LM317 or NE555 are part numbers when that index knows them
+        designators = [ref for ref in routed.refdes if not self._part_number_rows([ref]).size]
+        if designators:
+            hits = db.filter_rows({"REFDES": designators})
+            if hits.size:
+                route = "refdes"
+                wanted = set(designators)
+                rows.update((row, wanted) for row in hits.tolist())
+        
+        hits = self._part_number_rows(routed.identifiers + routed.refdes)
+        if hits.size:
+            route = route or "part_number"
+            rows.update((row, None) for row in hits.tolist())
+        return {"route": route or "semantic", "rows": dict(sorted(rows.items())[:EXACT_RESULT_LIMIT])}
+    
+    async def route_query(self, query: str, n_results: int = 5) -> Dict[str, Any]:
+        """Answer exact identifier questions from the hash index; embed only semantic questions
+
+        Exact matches are expanded to the asked-about refdes; semantic hits stay grouped per
+        unique part so a prompt is not flooded with hundreds of identical parts
+        """
+        exact = self._exact_lookup(query)
+        if exact["rows"]:
+            rows = list(exact["rows"])
+            results = []
+            for row, doc in zip(rows, self.components_db.get_documents_by_rows(rows)):
+                results.extend(self._expand_result(doc, 1.0, exact["rows"][row]))
+            results = results[:EXACT_RESULT_LIMIT]
+            logger.info(f"Routed query via {exact['route']} index: {len(results)} exact matches")
+            return {"route": exact["route"], "results": results}
+        
+        return {"route": "semantic", "results": await self.query_similar_components(query, n_results, expand=False)}
+    
+    def get_components(self, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """All stored components matching a metadata filter, one per refdes, without embedding the query"""
+        refdes, sources = _wanted(where, "REFDES"), _wanted(where, "source")
+        return [
+            {"content": result["content"], "metadata": result["metadata"]}
+            for doc in self.components_db.get_documents(where)
+            for result in self._expand_result(doc, 1.0, refdes, sources)
         ]
     
     def get_knowledge_stats(self) -> Dict[str, Any]:
@@ -162,6 +418,7 @@ class MemoryRAGService:
             "patterns_count": self.patterns_db.count(),
             "embedding_model": self.embedding_model,
             "db_type": "memory",
+            "embedding_client": self.embedding_client.get_stats(),
             **self.components_db.get_stats()
         }
     
@@ -173,7 +430,7 @@ class MemoryRAGService:
             patterns_count = self.patterns_db.count()
             total_items = components_count + patterns_count
             
-            # Test embedding service (with short timeout)
+            # Cached circuit state kept current by the health prober; no request to Ollama here
             embedding_accessible = await self.components_db.test_connection()
             
             status = {
@@ -188,7 +445,8 @@ class MemoryRAGService:
                 "embedding_service": {
                     "accessible": embedding_accessible,
                     "model": self.embedding_model,
-                    "url": self.ollama_url
+                    "url": self.ollama_url,
+                    "health": self.health_prober.get_stats()
                 },
                 "collections": {
                     "bom_components": {
@@ -0,0 +1,69 @@
+"""
+Inverted indexes over document metadata for filtered vector search
+Each indexed field maps value -> sorted array of matrix rows
+"""
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+class MetadataIndex:
+    """Per-field value -> row postings; rows are appended in increasing order so postings stay sorted"""
+
+    def __init__(self, fields: Iterable[str] = ("source", "type")):
+        self.fields = tuple(fields)
+        self._postings: Dict[str, Dict[Any, array]] = {field: {} for field in self.fields}
+
+    @staticmethod
+    def _values(value: Any) -> List[Any]:
+        """Indexable values of a metadata entry (list entries are indexed individually)"""
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        return [v for v in values if isinstance(v, (str, int, float, bool))]
+
+    def add(self, row: int, metadata: Dict[str, Any]):
+        """Index the metadata of a newly appended row"""
+        for field in self.fields:
+            if field not in metadata:
+                continue
+            postings = self._postings[field]
+            for value in self._values(metadata[field]):
+                rows = postings.get(value)
+                if rows is None:
+                    rows = postings[value] = array("q")
+                # A list value may repeat an entry; keep each row once per posting
+                if not rows or rows[-1] != row:
+                    rows.append(row)
+
+    def lookup(self, field: str, value: Any) -> np.ndarray:
+        """Rows whose field equals value, or any of the values when a list/tuple/set is given"""
+        postings = self._postings[field]
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        # Copy out of the array buffer so later appends are not blocked by an exported view
+        arrays = [np.frombuffer(postings[v], dtype=np.int64).copy() for v in values if v in postings]
+        if not arrays:
+            return np.empty(0, dtype=np.int64)
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.unique(np.concatenate(arrays))
+
+    def covers(self, field: str) -> bool:
+        return field in self._postings
+
+    def filter(self, where: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Intersect the postings of all indexed conditions; None if no condition is indexed"""
+        rows = None
+        for field, value in where.items():
+            if not self.covers(field):
+                continue
+            matched = self.lookup(field, value)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+            if rows.size == 0:
+                break
+        return rows
+
+    def reset(self):
+        self._postings = {field: {} for field in self.fields}
+
+    def get_stats(self) -> Dict[str, int]:
+        """Number of distinct values per indexed field"""
+        return {field: len(postings) for field, postings in self._postings.items()}
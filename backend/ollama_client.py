@@ -0,0 +1,253 @@
+"""
+Shared Ollama embedding client
+One pooled keep-alive aiohttp session per client, batched /api/embed requests
+and a bounded-concurrency pipeline whose width adapts to observed latency;
+calls go through a circuit breaker and a priority scheduler shared by all
+clients of the same server
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import aiohttp
+
+from circuit_breaker import CircuitBreaker, get_breaker
+from embedding_scheduler import BULK, INTERACTIVE, EmbeddingScheduler, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+class _EndpointMissing(Exception):
+    """Raised when the server has no batch embedding endpoint"""
+
+class OllamaEmbeddingClient:
+    """Embedding client that reuses one HTTP session and sends texts in batches"""
+
+    def __init__(self, ollama_url: str = "http://localhost:11434", embedding_model: str = "nomic-embed-text",
+                 batch_size: int = 64, timeout: float = 60.0, max_concurrency: int = 4,
+                 connect_timeout: float = 2.0, interactive_concurrency: int = 8):
+        self.ollama_url = ollama_url
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max(1, max_concurrency)
+        self.interactive_concurrency = max(1, interactive_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._batch_endpoint_supported = True  # Older Ollama versions only have /api/embeddings
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Lazily create the pooled keep-alive session on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency + self.interactive_concurrency,
+                                             keepalive_timeout=60)
+            timeout = aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._session_loop = loop
+        return self._session
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """Shared breaker of the configured server (looked up each time so URL changes apply)"""
+        return get_breaker(self.ollama_url)
+
+    @property
+    def scheduler(self) -> EmbeddingScheduler:
+        """Shared priority scheduler of the configured server"""
+        return get_scheduler(self.ollama_url, bulk_max_in_flight=self.max_concurrency,
+                             interactive_max_in_flight=self.interactive_concurrency)
+
+    @property
+    def available(self) -> bool:
+        """Cached health: False while the circuit is open, without a network call"""
+        return self.breaker.state != "open"
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def embed(self, text: str, priority: str = INTERACTIVE) -> List[float]:
+        """Embed a single text (a query, unless told otherwise)"""
+        return (await self.embed_batch([text], priority))[0]
+
+    async def embed_batch(self, texts: List[str], priority: str = BULK) -> List[List[float]]:
+        """Embed up to batch_size texts in one request; fails fast with CircuitOpenError while Ollama is down
+
+        The request waits for a slot of its priority class; bulk latency drives the adaptive bulk limit.
+        """
+        if not texts:
+            return []
+        breaker = self.breaker
+        trial = breaker.check()
+        scheduler = self.scheduler
+        recorded = False
+        try:
+            async with scheduler.slot(priority):
+                started = time.monotonic()
+                try:
+                    embeddings = await self._embed_batch(texts)
+                except Exception as e:
+                    breaker.record_failure(e)
+                    recorded = True
+                    if priority == BULK:
+                        scheduler.record_bulk_failure()
+                    raise
+                if priority == BULK:
+                    scheduler.record_bulk_latency(time.monotonic() - started, len(texts))
+            breaker.record_success()
+            recorded = True
+        finally:
+            # A cancelled trial has no outcome; without this the breaker would wait for it forever
+            if trial and not recorded:
+                breaker.release_trial()
+        return embeddings
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self._batch_endpoint_supported:
+            try:
+                return await self._post_embed(texts)
+            except _EndpointMissing:
+                logger.warning("Ollama has no /api/embed endpoint, falling back to one request per text")
+                self._batch_endpoint_supported = False
+        return [await self._post_legacy_embedding(text) for text in texts]
+
+    async def embed_batches(self, texts: List[str], priority: str = BULK) -> AsyncIterator[
+            Tuple[int, List[str], Union[List[List[float]], Exception]]]:
+        """Embed texts with concurrent workers and yield (start, batch, embeddings) in input order
+
+        A batch that failed yields its exception instead of embeddings so the caller can
+        fall back per batch without losing the rest of the run.
+        """
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        if not batches:
+            return
+        loop = asyncio.get_running_loop()
+        results = [loop.create_future() for _ in batches]
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(len(batches)):
+            queue.put_nowait(index)
+
+        async def worker():
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    results[index].set_result(await self.embed_batch(batches[index], priority))
+                except Exception as e:
+                    results[index].set_result(e)
+
+        # The scheduler decides how many of these actually have a request in flight
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.max_concurrency, len(batches)))]
+        try:
+            for index, batch in enumerate(batches):
+                yield index * self.batch_size, batch, await results[index]
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Batching and concurrency settings plus the current adaptive limit"""
+        return {
+            "batch_size": self.batch_size,
+            "batch_endpoint": self._batch_endpoint_supported,
+            "scheduler": self.scheduler.get_stats(),
+            "circuit": self.breaker.get_stats(),
+        }
+
+    async def _post_embed(self, texts: List[str]) -> List[List[float]]:
+        payload = {"model": self.embedding_model, "input": texts}
+        async with self._get_session().post(f"{self.ollama_url}/api/embed", json=payload) as response:
+            if response.status == 404:
+                error_text = await response.text()
+                # A missing model is also a 404; only a missing route means an old server
+                if "model" not in error_text.lower():
+                    raise _EndpointMissing()
+                raise Exception(f"HTTP 404: {error_text}")
+            if response.status != 200:
+                raise Exception(f"HTTP {response.status}: {await response.text()}")
+            result = await response.json()
+        embeddings = result.get("embeddings", [])
+        if len(embeddings) != len(texts) or not all(embeddings):
+            raise Exception(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+        return embeddings
+
+    async def _post_legacy_embedding(self, text: str) -> List[float]:
+        payload = {"model": self.embedding_model, "prompt": text}
+        async with self._get_session().post(f"{self.ollama_url}/api/embeddings", json=payload) as response:
+            if response.status != 200:
+                raise Exception(f"HTTP {response.status}: {await response.text()}")
+            result = await response.json()
+        embedding = result.get("embedding", [])
+        if not embedding:
+            raise Exception("No embedding in response")
+        return embedding
+
+class OllamaHealthProber:
+    """Background task that pings /api/tags and feeds the result into the shared breaker,
+    so an open circuit closes as soon as the server is back and status reads need no request"""
+
+    def __init__(self, ollama_url: str = "http://localhost:11434", interval: float = 10.0, timeout: float = 3.0):
+        self.ollama_url = ollama_url
+        self.interval = interval
+        self.timeout = timeout
+        self.breaker = get_breaker(ollama_url)
+        self.healthy: Optional[bool] = None  # Unknown until the first probe
+        self.last_checked: Optional[float] = None
+        self.last_latency_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def probe(self) -> bool:
+        """Run one health check now"""
+        started = time.monotonic()
+        try:
+            timeout = aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.timeout)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(f"{self.ollama_url}/api/tags") as response:
+                    if response.status != 200:
+                        raise Exception(f"HTTP {response.status}")
+            self.healthy = True
+            self.last_error = None
+            self.breaker.record_success()
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e) or type(e).__name__
+            self.breaker.record_failure(e)
+        self.last_checked = time.time()
+        self.last_latency_ms = round((time.monotonic() - started) * 1000, 2)
+        return self.healthy
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cached result of the last probe plus the breaker state"""
+        return {
+            "healthy": self.healthy,
+            "last_checked": self.last_checked,
+            "last_latency_ms": self.last_latency_ms,
+            "last_error": self.last_error,
+            "probe_interval_seconds": self.interval,
+            "circuit": self.breaker.get_stats(),
+        }
@@ -0,0 +1,82 @@
+"""
+Parsed BOMs keyed by the SHA-256 of the uploaded bytes
+Entries are the compact serialized ParsedBom, so the byte bound is exact; the least
+recently used entries are evicted first. Concurrent requests for the same document
+share one parse.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class ParseCache:
+    """Byte-bounded LRU of serialized parse results"""
+
+    def __init__(self, max_bytes: int = 256 << 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._parsing: Dict[str, asyncio.Future] = {}
+
+    def get(self, digest: str) -> Optional[bytes]:
+        blob = self._entries.get(digest)
+        if blob is not None:
+            self._entries.move_to_end(digest)
+        return blob
+
+    def put(self, digest: str, blob: bytes):
+        """Store an entry; one larger than the whole cache is not kept"""
+        if len(blob) > self.max_bytes:
+            return
+        previous = self._entries.pop(digest, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[digest] = blob
+        self.size += len(blob)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    async def get_or_parse(self, digest: str, parse: Callable[[], Awaitable[bytes]]) -> bytes:
+        """The cached entry, or the result of parse() (awaited once per digest at a time)"""
+        blob = self.get(digest)
+        if blob is not None:
+            self.hits += 1
+            return blob
+        parsing = self._parsing.get(digest)
+        if parsing is not None:
+            self.hits += 1
+            return await asyncio.shield(parsing)
+        self.misses += 1
+        parsing = self._parsing[digest] = asyncio.get_running_loop().create_future()
+        try:
+            blob = await parse()
+        except asyncio.CancelledError:
+            parsing.cancel()
+            raise
+        except Exception as e:
+            parsing.set_exception(e)
+            parsing.exception()  # Mark retrieved: there may be no other waiter
+            raise
+        finally:
+            del self._parsing[digest]
+        parsing.set_result(blob)
+        self.put(digest, blob)
+        logger.info(f"Cached parse of {digest[:12]} ({len(blob)} bytes, {self.size} bytes cached)")
+        return blob
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,145 @@
+"""
+Process pool for CPU-bound BOM work (parsing and diffing)
+Jobs run in worker processes so a large upload never stalls the event loop;
+the number of queued plus running jobs is bounded and queue wait and run time
+are tracked per job kind
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Run times kept per job kind for percentiles
+RUN_SAMPLES = 256
+
+class ParsePoolFullError(Exception):
+    """Raised instead of queueing a job when max_pending jobs are already queued or running"""
+
+def _timed(fn: Callable, args: Tuple) -> Tuple[Any, float]:
+    """Runs in the worker: the job result plus its run time there"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+class _JobKind:
+    """Counters of one kind of job"""
+
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+        self.recent_runs: Deque[float] = deque(maxlen=RUN_SAMPLES)
+
+    def record(self, wait: float, run: float):
+        self.completed += 1
+        self.total_wait += wait
+        self.total_run += run
+        self.max_run = max(self.max_run, run)
+        self.recent_runs.append(run)
+
+    def get_stats(self) -> Dict[str, Any]:
+        runs = sorted(self.recent_runs)
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.completed * 1000, 3) if self.completed else 0.0,
+            "avg_run_ms": round(self.total_run / self.completed * 1000, 3) if self.completed else 0.0,
+            "p99_run_ms": round(runs[min(len(runs) - 1, int(len(runs) * 0.99))] * 1000, 3) if runs else 0.0,
+            "max_run_ms": round(self.max_run * 1000, 3),
+        }
+
+class ParsePool:
+    """Process pool with a bounded queue and per-kind timing
+
+    run() rejects with ParsePoolFullError once max_pending jobs are queued or running
+    (request handlers answer 503); map() waits for room instead and keeps at most
+    max_workers of its own jobs in flight so a bulk upload leaves room for requests.
+    Wait time is submit-to-result minus the run time measured in the worker, so it
+    includes the pickling of arguments and results.
+    """
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 8):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._room: Optional[asyncio.Condition] = None
+        self._room_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._kinds: Dict[str, _JobKind] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _get_room(self) -> asyncio.Condition:
+        """Condition signalled whenever a job finishes (created on the running loop)"""
+        loop = asyncio.get_running_loop()
+        if self._room is None or self._room_loop is not loop:
+            self._room = asyncio.Condition()
+            self._room_loop = loop
+        return self._room
+
+    def _kind(self, kind: str) -> _JobKind:
+        stats = self._kinds.get(kind)
+        if stats is None:
+            stats = self._kinds[kind] = _JobKind()
+        return stats
+
+    async def run(self, kind: str, fn: Callable, *args, wait: bool = False) -> Any:
+        """Run fn(*args) in a worker process; fn and its arguments and result must pickle"""
+        stats = self._kind(kind)
+        room = self._get_room()
+        if self.pending >= self.max_pending:
+            if not wait:
+                stats.rejected += 1
+                raise ParsePoolFullError(f"{self.pending} parse jobs already queued or running")
+            async with room:
+                await room.wait_for(lambda: self.pending < self.max_pending)
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            result, run = await asyncio.get_running_loop().run_in_executor(self._get_executor(), _timed, fn, args)
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+            async with room:
+                room.notify()
+        elapsed = time.perf_counter() - submitted
+        stats.record(max(0.0, elapsed - run), run)
+        logger.info(f"Parse job {kind} ran {run * 1000:.1f} ms in a worker, {elapsed * 1000:.1f} ms end to end")
+        return result
+
+    async def map(self, kind: str, fn: Callable, arg_tuples: Sequence[Tuple]) -> List[Any]:
+        """Run fn over many argument tuples; results in input order"""
+        in_flight = asyncio.Semaphore(self.max_workers)
+
+        async def run_one(args: Tuple) -> Any:
+            async with in_flight:
+                return await self.run(kind, fn, *args, wait=True)
+
+        return await asyncio.gather(*[run_one(args) for args in arg_tuples])
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool size, queue occupancy and timing per job kind"""
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "jobs": {kind: stats.get_stats() for kind, stats in self._kinds.items()},
+        }
@@ -0,0 +1,52 @@
+"""
+Query routing for RAG retrieval
+Exact reference designator / part number questions are answered from the
+metadata hash index; only semantic questions are embedded
+"""
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from refdes import expand_range
+
+# C999, R1-R5, L40-41 (prefix must be upper case to avoid matching ordinary words)
+REFDES_PATTERN = re.compile(r"\b([A-Z]{1,3})(\d{1,5})(?:\s*-\s*(?:([A-Z]{1,3}))?(\d{1,5}))?\b")
+# Identifier-like tokens that may be part numbers: contain a digit, at least 3 chars
+IDENTIFIER_PATTERN = re.compile(r"(?<![\w./-])(?=[\w./-]*\d)[A-Za-z0-9][\w./-]{2,}(?<![./-])")
+@dataclass
+class RoutedQuery:
+    """Exact identifiers detected in a user question"""
+    refdes: List[str] = field(default_factory=list)
+    identifiers: List[str] = field(default_factory=list)
+
+    @property
+    def has_identifiers(self) -> bool:
+        return bool(self.refdes or self.identifiers)
+
+def classify_query(text: str) -> RoutedQuery:
+    """Extract reference designators (with ranges expanded) and other identifier tokens"""
+    routed = RoutedQuery()
+    seen = set()
+
+    def add(target: List[str], value: str):
+        if value not in seen:
+            seen.add(value)
+            target.append(value)
+
+    # Only the matched spans are cut out: the same letters may occur inside a part number
+    pieces, last = [], 0
+    for match in REFDES_PATTERN.finditer(text):
+        prefix, start, end_prefix, end = match.groups()
+        if end is None:
+            add(routed.refdes, f"{prefix}{start}")
+        else:
+            for ref in expand_range(f"{prefix}{start}", f"{end_prefix or prefix}{end}"):
+                add(routed.refdes, ref)
+        pieces.append(text[last:match.start()])
+        last = match.end()
+    pieces.append(text[last:])
+    remainder = " ".join(pieces)
+
+    for token in IDENTIFIER_PATTERN.findall(remainder):
+        add(routed.identifiers, token)
+    return routed
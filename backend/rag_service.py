@@ -6,15 +6,19 @@ import json
 import logging
 from pathlib import Path
 import asyncio
-import aiohttp
 import xml.etree.ElementTree as ET
+from ollama_client import OllamaEmbeddingClient
+from embedding_scheduler import BULK, INTERACTIVE
 
 logger = logging.getLogger(__name__)
 
 class BOMRAGService:
-    def __init__(self, ollama_url: str = "http://localhost:11434", embedding_model: str = "nomic-embed-text"):
+    def __init__(self, ollama_url: str = "http://localhost:11434", embedding_model: str = "nomic-embed-text",
+                 embedding_batch_size: int = 64, embedding_concurrency: int = 4):
         self.ollama_url = ollama_url
         self.embedding_model = embedding_model
+        self.embedding_client = OllamaEmbeddingClient(ollama_url, embedding_model, batch_size=embedding_batch_size,
+                                                      max_concurrency=embedding_concurrency)
         
         # Initialize Chroma DB
         self.client = chromadb.PersistentClient(
@@ -52,21 +56,7 @@ class BOMRAGService:
     async def generate_embedding(self, text: str) -> List[float]:
         """Generate embeddings using Ollama"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.ollama_url}/api/embeddings",
-                    json={
-                        "model": self.embedding_model,
-                        "prompt": text
-                    },
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return result.get("embedding", [])
-                    else:
-                        logger.error(f"Embedding API error: {response.status}")
-                        return []
+            return await self.embedding_client.embed(text, INTERACTIVE)
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
             return []
@@ -147,13 +137,16 @@ class BOMRAGService:
                 # Generate embeddings for all documents using Ollama
                 logger.info(f"Generating embeddings for {len(documents)} documents")
                 embeddings = []
-                for doc in documents:
-                    embedding = await self.generate_embedding(doc)
-                    if embedding:
-                        embeddings.append(embedding)
-                    else:
-                        logger.warning(f"Failed to generate embedding for document: {doc[:50]}...")
-                        embeddings.append([0.0] * 384)  # Fallback embedding
+                async for _, batch, batch_embeddings in self.embedding_client.embed_batches(documents, BULK):
+                    if isinstance(batch_embeddings, Exception):
+                        logger.error(f"Batch embedding generation failed: {batch_embeddings}")
+                        batch_embeddings = [[] for _ in batch]
+                    for doc, embedding in zip(batch, batch_embeddings):
+                        if embedding:
+                            embeddings.append(embedding)
+                        else:
+                            logger.warning(f"Failed to generate embedding for document: {doc[:50]}...")
+                            embeddings.append([0.0] * 384)  # Fallback embedding
                 
                 logger.info(f"Generated {len(embeddings)} embeddings")
                 
@@ -0,0 +1,99 @@
+"""
+Reference designator parsing, range expansion and range compression
+A designator parses into (prefix, number, suffix): "C12" -> ("C", 12, ""),
+"U3A" -> ("U", 3, "A"). Lists such as "R1-R5, C7, L40-41" expand lazily, sort
+naturally (R2 before R10), and sets compress back into ranges ("C1-C40,C45")
+"""
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Prefix without digits, the number, an optional suffix without digits (U3A, TP12_B)
+DESIGNATOR_PATTERN = re.compile(r"([^\d\s,]*)(\d+)([^\d\s,-]*)")
+# Largest range that is expanded (R1-R100000 is almost certainly not a designator range)
+MAX_RANGE_SIZE = 1000
+# Shortest run of consecutive numbers written as a range (C1,C2 stays a list)
+MIN_RUN = 3
+
+Designator = Tuple[str, int, str]
+
+def parse(ref: str) -> Optional[Designator]:
+    """(prefix, number, suffix) of one designator, or None if it has no number"""
+    match = DESIGNATOR_PATTERN.fullmatch(ref.strip())
+    if match is None:
+        return None
+    prefix, number, suffix = match.groups()
+    return prefix, int(number), suffix
+
+def natural_key(ref: str) -> Tuple:
+    """Sort key ordering designators by prefix, then numerically"""
+    parsed = parse(ref)
+    if parsed is None:
+        return ref, -1, "", ref
+    prefix, number, suffix = parsed
+    return prefix, number, suffix, ref
+
+def natural_sort(refs: Iterable[str]) -> List[str]:
+    return sorted(refs, key=natural_key)
+
+def expand_range(first: str, last: str, max_size: int = MAX_RANGE_SIZE) -> Iterator[str]:
+    """Designators from first to last inclusive (R1..R5, or L40..41 with the prefix implied)
+
+    Endpoints that do not form a range (other prefix or suffix, descending, longer
+    than max_size, unparseable) are yielded as they are.
+    """
+    start, end = parse(first), parse(last)
+    if start is not None and last.strip().isdigit():
+        end = (start[0], int(last), start[2])
+        last = f"{start[0]}{last.strip()}{start[2]}"
+    if (start is None or end is None or start[0] != end[0] or start[2] != end[2]
+            or end[1] < start[1] or end[1] - start[1] > max_size):
+        yield first.strip()
+        if last.strip() != first.strip():
+            yield last.strip()
+        return
+    prefix, _, suffix = start
+    for number in range(start[1], end[1] + 1):
+        yield f"{prefix}{number}{suffix}"
+
+def expand(text: str, max_size: int = MAX_RANGE_SIZE) -> Iterator[str]:
+    """Designators of a list like "R1-R5, C7, L40-41", lazily and in the order written"""
+    for token in text.split(","):
+        token = token.strip()
+        if not token:
+            continue
+        first, sep, last = token.partition("-")
+        if sep and last and "-" not in last and parse(first) is not None:
+            yield from expand_range(first, last, max_size)
+        else:
+            yield token  # A single designator, or a name that merely contains a dash
+
+def compress(refs: Iterable[str]) -> str:
+    """Compact, naturally sorted text for a set of designators: "C1-C40,C45,R7"
+
+    Items may themselves be lists or ranges; duplicates are dropped.
+    """
+    unique = {ref for item in refs for ref in expand(item)}
+    parts: List[str] = []
+    run: List[Designator] = []
+
+    def flush():
+        if len(run) >= MIN_RUN:
+            (prefix, first, suffix), last = run[0], run[-1][1]
+            parts.append(f"{prefix}{first}{suffix}-{prefix}{last}{suffix}")
+        else:
+            parts.extend(f"{prefix}{number}{suffix}" for prefix, number, suffix in run)
+        run.clear()
+
+    for ref in natural_sort(unique):
+        parsed = parse(ref)
+        if parsed is None or f"{parsed[0]}{parsed[1]}{parsed[2]}" != ref:  # Unparsed or zero-padded: as is
+            flush()
+            parts.append(ref)
+            continue
+        if run and (parsed[0], parsed[2]) == (run[-1][0], run[-1][2]) and parsed[1] == run[-1][1] + 1:
+            run.append(parsed)
+            continue
+        flush()
+        run.append(parsed)
+    flush()
+    return ",".join(parts)
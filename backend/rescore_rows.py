@@ -0,0 +1,68 @@
+"""
+Full-precision rows for rescoring a compact (float16/int8) MemoryVectorDB
+The float32 copies stay on disk and are read through memory maps, so rescoring a
+shortlist needs no second full-size matrix on the heap
+"""
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+
+class RescoreRows:
+    """Float32 copies of the stored rows: an optional read-only base (the snapshot's
+    memory-mapped array) followed by rows appended to an unnamed scratch file"""
+
+    def __init__(self, dimension: int, directory: Optional[str] = None, base: Optional[np.ndarray] = None):
+        self.dimension = dimension
+        self.directory = directory  # Where the scratch file is created (None: system temp dir)
+        self.base = base if base is not None else np.zeros((0, dimension), dtype=np.float32)
+        self._appended = None
+        self._appended_rows = 0
+        self._appended_map: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return len(self.base) + self._appended_rows
+
+    @property
+    def nbytes(self) -> int:
+        return len(self) * self.dimension * 4
+
+    def append(self, vector: np.ndarray):
+        if self._appended is None:
+            self._appended = tempfile.TemporaryFile(dir=self.directory)
+        self._appended.write(np.asarray(vector, dtype=np.float32).tobytes())
+        self._appended_rows += 1
+
+    def _appended_view(self) -> np.ndarray:
+        """Memory map of the appended rows, remapped when rows were added since the last one"""
+        if self._appended_rows == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        if self._appended_map is None or len(self._appended_map) < self._appended_rows:
+            self._appended.flush()
+            self._appended_map = np.memmap(self._appended, dtype=np.float32, mode="r",
+                                           shape=(self._appended_rows, self.dimension))
+        return self._appended_map
+
+    def rows(self, indices: np.ndarray) -> np.ndarray:
+        """The given rows as a float32 array (only these are read into memory)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        base_rows = len(self.base)
+        if indices.size == 0 or indices.max() < base_rows:
+            return np.asarray(self.base[indices], dtype=np.float32)
+        block = np.empty((len(indices), self.dimension), dtype=np.float32)
+        in_base = indices < base_rows
+        block[in_base] = self.base[indices[in_base]]
+        block[~in_base] = self._appended_view()[indices[~in_base] - base_rows]
+        return block
+
+    def blocks(self, count: int) -> List[np.ndarray]:
+        """The first count rows as consecutive arrays (for writing a snapshot without joining them)"""
+        base = self.base[:count]
+        return [base, self._appended_view()[:count - len(base)]]
+
+    def close(self):
+        self._appended_map = None
+        if self._appended is not None:
+            self._appended.close()
+            self._appended = None
+        self._appended_rows = 0
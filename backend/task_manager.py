@@ -0,0 +1,343 @@
+"""
+Background task manager
+Runs tasks on a bounded pool of asyncio workers, keeps an index of unfinished
+tasks, evicts finished ones by age and count, and persists task state to SQLite
+so interrupted tasks resume from their last checkpoint after a restart;
+state changes are broadcast to subscribers (server-sent event streams)
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+UNFINISHED = (QUEUED, RUNNING)
+
+class TaskDeferred(Exception):
+    """Raised by a handler that cannot make progress now (e.g. Ollama is down); the task is
+    queued again after retry_after seconds and resumes from its checkpoint"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TaskStatus:
+    def __init__(self, task_id: str, task_type: str, total_items: int = 0, payload: Optional[Dict[str, Any]] = None):
+        self.task_id = task_id
+        self.task_type = task_type
+        self.status = QUEUED  # queued, running, completed, failed
+        self.progress = 0
+        self.total_items = total_items
+        self.message = ""
+        self.started_at = datetime.now()
+        self.completed_at = None
+        self.error = None
+        self.payload = payload or {}  # Handler input, kept until the task finishes
+        self.checkpoint = 0  # Handler-defined resume point (e.g. documents committed)
+        self.details: Dict[str, Any] = {}  # Handler-defined progress breakdown (e.g. per file)
+        self.deferrals = 0  # Pauses since the checkpoint last advanced (not persisted)
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in UNFINISHED
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "task_id": self.task_id,
+            "task_type": self.task_type,
+            "status": self.status,
+            "progress": self.progress,
+            "total_items": self.total_items,
+            "message": self.message,
+            "started_at": self.started_at.isoformat(),
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "error": self.error,
+            "checkpoint": self.checkpoint,
+            "details": self.details,
+        }
+
+class TaskEventChannel:
+    """Broadcasts task events to per-subscriber queues
+
+    Progress events are throttled per task to one per min_interval; state changes
+    (started, completed, failed) always go out. A slow subscriber loses its oldest
+    queued events, never the latest.
+    """
+
+    def __init__(self, min_interval: float = 0.25, queue_size: int = 16):
+        self.min_interval = min_interval
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._last_progress: Dict[str, float] = {}
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[task_id]
+                self._last_progress.pop(task_id, None)
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, task_id: str, event: str, data: Dict[str, Any], throttle: bool = False):
+        subscribers = self._subscribers.get(task_id)
+        if not subscribers:
+            return  # Nobody is listening; progress updates stay free
+        if throttle:
+            now = time.monotonic()
+            if now - self._last_progress.get(task_id, 0.0) < self.min_interval:
+                return
+            self._last_progress[task_id] = now
+        for queue in subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait({"event": event, "data": data})
+
+# A handler receives its task and reports through TaskManager.update_progress / set_checkpoint
+TaskHandler = Callable[[TaskStatus], Awaitable[Optional[str]]]
+
+class TaskManager:
+    """Bounded worker pool over a queue of persisted tasks"""
+
+    def __init__(self, max_workers: int = 2, ttl_seconds: float = 3600, max_finished: int = 200,
+                 event_interval: float = 0.25, max_deferrals: int = 40):
+        self.max_workers = max(1, max_workers)
+        # A task paused this many times without advancing its checkpoint fails instead
+        self.max_deferrals = max_deferrals
+        self.events = TaskEventChannel(event_interval)
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_finished = max_finished
+        self._handlers: Dict[str, TaskHandler] = {}
+        self._tasks: "OrderedDict[str, TaskStatus]" = OrderedDict()  # Insertion (start) order
+        self._unfinished: Dict[str, TaskStatus] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._db: Optional[sqlite3.Connection] = None
+
+    def register(self, task_type: str, handler: TaskHandler):
+        """Handler used to run (and resume) tasks of a type"""
+        self._handlers[task_type] = handler
+
+    # Persistence
+
+    def open(self, path: str) -> int:
+        """Load persisted tasks; unfinished ones are queued again to resume from their checkpoint"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, task_type TEXT NOT NULL, status TEXT NOT NULL, "
+            "progress INTEGER NOT NULL, total_items INTEGER NOT NULL, message TEXT, "
+            "started_at TEXT NOT NULL, completed_at TEXT, error TEXT, payload TEXT, "
+            "checkpoint INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.commit()
+
+        resumed = 0
+        rows = self._db.execute(
+            "SELECT task_id, task_type, status, progress, total_items, message, started_at, "
+            "completed_at, error, payload, checkpoint FROM tasks ORDER BY started_at"
+        ).fetchall()
+        for (task_id, task_type, status, progress, total_items, message, started_at,
+             completed_at, error, payload, checkpoint) in rows:
+            task = TaskStatus(task_id, task_type, total_items, json.loads(payload) if payload else None)
+            task.status, task.progress, task.message, task.error = status, progress, message or "", error
+            task.started_at = datetime.fromisoformat(started_at)
+            task.completed_at = datetime.fromisoformat(completed_at) if completed_at else None
+            task.checkpoint = checkpoint
+            self._tasks[task_id] = task
+            if task.finished:
+                continue
+            if task_type in self._handlers:
+                task.status = QUEUED
+                task.message = f"Resuming after restart from checkpoint {checkpoint}"
+                self._unfinished[task_id] = task
+                resumed += 1
+            else:
+                self._finish(task, FAILED, "Interrupted by restart", error="No handler to resume this task")
+        self._evict()
+        if resumed:
+            logger.info(f"Resuming {resumed} interrupted background tasks")
+        return resumed
+
+    def _persist(self, task: TaskStatus, with_payload: bool = False):
+        if self._db is None:
+            return
+        payload = json.dumps(task.payload, separators=(",", ":")) if with_payload and not task.finished else None
+        self._db.execute(
+            "INSERT INTO tasks (task_id, task_type, status, progress, total_items, message, started_at, "
+            "completed_at, error, payload, checkpoint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(task_id) DO UPDATE SET status = excluded.status, progress = excluded.progress, "
+            "total_items = excluded.total_items, message = excluded.message, "
+            "completed_at = excluded.completed_at, error = excluded.error, checkpoint = excluded.checkpoint, "
+            "payload = CASE WHEN excluded.status IN ('completed', 'failed') THEN NULL "
+            "ELSE COALESCE(excluded.payload, tasks.payload) END",
+            (task.task_id, task.task_type, task.status, task.progress, task.total_items, task.message,
+             task.started_at.isoformat(), task.completed_at.isoformat() if task.completed_at else None,
+             task.error, payload, task.checkpoint)
+        )
+        self._db.commit()
+
+    # Worker pool
+
+    async def start(self):
+        """Start the workers on the running loop and queue any resumed tasks"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        for task in self._unfinished.values():
+            self._queue.put_nowait(task.task_id)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def stop(self):
+        """Cancel the workers; running tasks stay unfinished on disk and resume on the next start"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def _worker(self):
+        while True:
+            task_id = await self._queue.get()
+            task = self._unfinished.get(task_id)
+            if task is None or task.status == RUNNING:
+                continue  # Finished, or queued again (after a pause) while it runs
+            handler = self._handlers[task.task_type]
+            task.status = RUNNING
+            self._persist(task)
+            self.events.publish(task_id, RUNNING, task.to_dict())
+            try:
+                message = await handler(task)
+                task.progress = 100
+                self._finish(task, COMPLETED, message or "Completed")
+            except asyncio.CancelledError:
+                raise
+            except TaskDeferred as e:
+                self._defer(task, e)
+            except Exception as e:
+                logger.error(f"Background task {task_id} failed: {e}")
+                self._finish(task, FAILED, f"Failed: {e}", error=str(e))
+
+    def _defer(self, task: TaskStatus, deferred: TaskDeferred):
+        """Queue a paused task again once its retry delay has passed, unless it keeps pausing
+        without making progress"""
+        task.deferrals += 1
+        if task.deferrals > self.max_deferrals:
+            logger.error(f"Background task {task.task_id} failed after {self.max_deferrals} pauses: {deferred}")
+            error = f"Gave up after {self.max_deferrals} pauses: {deferred}"
+            self._finish(task, FAILED, f"Failed: {error}", error=error)
+            return
+        logger.warning(f"Background task {task.task_id} paused at checkpoint {task.checkpoint}: {deferred}")
+        task.status = QUEUED
+        task.message = f"Paused: {deferred}; resuming from checkpoint {task.checkpoint}"
+        self._persist(task)
+        self.events.publish(task.task_id, QUEUED, task.to_dict())
+        asyncio.get_running_loop().call_later(deferred.retry_after, self._requeue, task.task_id)
+
+    def _requeue(self, task_id: str):
+        if task_id in self._unfinished and self._queue is not None:
+            self._queue.put_nowait(task_id)
+
+    def submit(self, task_type: str, payload: Dict[str, Any], total_items: int = 0) -> TaskStatus:
+        """Persist and queue a task; it runs once a worker is free"""
+        if task_type not in self._handlers:
+            raise ValueError(f"No handler registered for task type '{task_type}'")
+        task = TaskStatus(str(uuid.uuid4()), task_type, total_items, payload)
+        task.message = "Queued"
+        self._tasks[task.task_id] = task
+        self._unfinished[task.task_id] = task
+        self._persist(task, with_payload=True)
+        if self._queue is None:
+            raise RuntimeError("TaskManager.start() has not been called")
+        self._queue.put_nowait(task.task_id)
+        return task
+
+    # Progress reporting
+
+    def update_progress(self, task_id: str, current: int, total: int, message: Optional[str] = None,
+                        details: Optional[Dict[str, Any]] = None):
+        """In-memory progress update (not persisted; see set_checkpoint)"""
+        task = self._unfinished.get(task_id)
+        if task:
+            task.progress = int((current / total) * 100) if total > 0 else 0
+            task.message = message or f"Processing component {current} of {total}"
+            if details is not None:
+                task.details = details
+            self.events.publish(task_id, "progress", task.to_dict(), throttle=True)
+
+    def set_checkpoint(self, task_id: str, checkpoint: int):
+        """Record durable progress; a resumed task starts from here"""
+        task = self._unfinished.get(task_id)
+        if task:
+            if checkpoint > task.checkpoint:
+                task.deferrals = 0
+            task.checkpoint = checkpoint
+            self._persist(task)
+
+    def _finish(self, task: TaskStatus, status: str, message: str, error: Optional[str] = None):
+        task.status = status
+        task.message = message
+        task.error = error
+        task.completed_at = datetime.now()
+        task.payload = {}
+        self._unfinished.pop(task.task_id, None)
+        self._persist(task)
+        self.events.publish(task.task_id, status, task.to_dict())
+        self._evict()
+
+    # Lookup and eviction
+
+    def _evict(self):
+        """Drop finished tasks past their TTL, then the oldest beyond max_finished"""
+        cutoff = datetime.now() - self.ttl
+        finished = [task for task in self._tasks.values() if task.finished]
+        expired = [task for task in finished if task.completed_at and task.completed_at < cutoff]
+        overflow = len(finished) - len(expired) - self.max_finished
+        if overflow > 0:
+            expired_ids = {task.task_id for task in expired}
+            remaining = [task for task in finished if task.task_id not in expired_ids]
+            remaining.sort(key=lambda task: task.completed_at or task.started_at)
+            expired.extend(remaining[:overflow])
+        for task in expired:
+            del self._tasks[task.task_id]
+        if expired and self._db is not None:
+            self._db.executemany("DELETE FROM tasks WHERE task_id = ?", [(task.task_id,) for task in expired])
+            self._db.commit()
+
+    def get(self, task_id: str) -> Optional[TaskStatus]:
+        self._evict()
+        return self._tasks.get(task_id)
+
+    def unfinished(self) -> List[TaskStatus]:
+        """Queued and running tasks (from the index, not a scan of all tasks)"""
+        return list(self._unfinished.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "queued": sum(1 for task in self._unfinished.values() if task.status == QUEUED),
+            "running": sum(1 for task in self._unfinished.values() if task.status == RUNNING),
+            "tracked": len(self._tasks),
+            "stream_subscribers": self.events.subscriber_count(),
+        }
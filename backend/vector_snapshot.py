@@ -0,0 +1,133 @@
+"""
+On-disk snapshots of a MemoryVectorDB
+Embedding arrays are stored as .npy files so they can be memory-mapped on load
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+DOCUMENTS_FILE = "documents.jsonl"
+
+def _fsync_path(path: str):
+    """Flush a file to stable storage"""
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+def _write_current(directory: str, name: str):
+    """Atomically point CURRENT at the named snapshot"""
+    tmp_path = os.path.join(directory, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, CURRENT_FILE))
+
+def current_snapshot(directory: str) -> Optional[str]:
+    """Path of the active snapshot in a directory, if any"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isdir(path) else None
+
+def _save_blocks(path: str, blocks: Sequence[np.ndarray]):
+    """np.save of the row-wise concatenation of blocks, without building it in memory"""
+    shape = (sum(len(block) for block in blocks),) + blocks[0].shape[1:]
+    if shape[0] == 0:
+        np.save(path, np.zeros(shape, dtype=blocks[0].dtype))
+        return
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=blocks[0].dtype, shape=shape)
+    start = 0
+    for block in blocks:
+        out[start:start + len(block)] = block
+        start += len(block)
+    out.flush()
+    del out
+
+def write_snapshot(directory: str, manifest: Dict[str, Any], arrays: Dict[str, Union[np.ndarray, Sequence[np.ndarray]]],
+                   documents: Iterable[Tuple[str, str, Dict[str, Any]]]) -> str:
+    """Write a new snapshot and make it current; older snapshots are removed
+
+    An array may be given as a list of blocks that are stored as one array.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"snapshot-{time.time_ns()}"
+    tmp_dir = os.path.join(directory, name + ".tmp")
+    os.makedirs(tmp_dir)
+
+    for key, array in arrays.items():
+        path = os.path.join(tmp_dir, f"{key}.npy")
+        if isinstance(array, list):
+            _save_blocks(path, array)
+        else:
+            np.save(path, array)
+        _fsync_path(path)
+
+    documents_path = os.path.join(tmp_dir, DOCUMENTS_FILE)
+    with open(documents_path, "w", encoding="utf-8") as f:
+        for doc_id, content, metadata in documents:
+            f.write(json.dumps([doc_id, content, metadata], separators=(",", ":")) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    manifest_path = os.path.join(tmp_dir, MANIFEST_FILE)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({**manifest, "version": SNAPSHOT_VERSION, "arrays": list(arrays)}, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    final_dir = os.path.join(directory, name)
+    os.rename(tmp_dir, final_dir)
+    _write_current(directory, name)
+
+    # Older complete snapshots only: a .tmp directory belongs to a writer that may still be running.
+    # Snapshots still memory-mapped elsewhere may refuse deletion (Windows); retried on next save
+    for entry in os.listdir(directory):
+        if entry.startswith("snapshot-") and entry != name and not entry.endswith(".tmp"):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    logger.info(f"Wrote snapshot {final_dir}")
+    return final_dir
+
+def remove_incomplete_snapshots(directory: str) -> int:
+    """Delete .tmp directories left by interrupted writers; call only before any writer starts"""
+    if not os.path.isdir(directory):
+        return 0
+    stale = [entry for entry in os.listdir(directory) if entry.startswith("snapshot-") and entry.endswith(".tmp")]
+    for entry in stale:
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    if stale:
+        logger.info(f"Removed {len(stale)} incomplete snapshots from {directory}")
+    return len(stale)
+
+def read_snapshot(directory: str, mmap: bool = True) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray], List[list]]]:
+    """Load the current snapshot as (manifest, arrays, [id, content, metadata] rows)"""
+    path = current_snapshot(directory)
+    if path is None:
+        return None
+
+    with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest.get('version')} in {path}")
+
+    arrays = {
+        key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r" if mmap else None)
+        for key in manifest["arrays"]
+    }
+    with open(os.path.join(path, DOCUMENTS_FILE), encoding="utf-8") as f:
+        documents = [json.loads(line) for line in f]
+
+    return manifest, arrays, documents
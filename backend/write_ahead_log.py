@@ -0,0 +1,142 @@
+"""
+Append-only write-ahead log for MemoryVectorDB
+Records are length-prefixed and CRC-checked; only committed batches are replayed
+"""
+import json
+import logging
+import os
+import re
+import struct
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OP_ADD = 1
+OP_CLEAR = 2
+OP_COMMIT = 3
+
+# op (u8), payload length (u32), crc32 of payload (u32)
+RECORD_HEADER = struct.Struct("<BII")
+SEGMENT_PATTERN = re.compile(r"^wal-(\d{8})\.log$")
+
+class WriteAheadLog:
+    """Segmented binary log of document inserts and clears"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self.segment: Optional[int] = None
+        self.pending_records = 0
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"wal-{segment:08d}.log")
+
+    def segments(self) -> List[int]:
+        """Sequence numbers of the segments on disk, oldest first"""
+        found = []
+        for entry in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(entry)
+            if match:
+                found.append(int(match.group(1)))
+        return sorted(found)
+
+    def size_bytes(self) -> int:
+        """Total size of all segments"""
+        return sum(os.path.getsize(self._segment_path(s)) for s in self.segments())
+
+    def open(self):
+        """Start a fresh segment for appends (torn tails of older segments are left alone)"""
+        existing = self.segments()
+        self._open_segment(existing[-1] + 1 if existing else 0)
+
+    def _open_segment(self, segment: int):
+        if self._file is not None:
+            self._file.close()
+        self.segment = segment
+        self._file = open(self._segment_path(segment), "ab")
+
+    def _write(self, op: int, payload: bytes = b""):
+        self._file.write(RECORD_HEADER.pack(op, len(payload), zlib.crc32(payload)) + payload)
+
+    def append_add(self, doc_id: str, content: str, metadata: Dict[str, Any], vector: np.ndarray):
+        """Log a document insert; durable only after the next commit()"""
+        header = json.dumps([doc_id, content, metadata], separators=(",", ":")).encode("utf-8")
+        payload = struct.pack("<I", len(header)) + header + np.asarray(vector, dtype=np.float32).tobytes()
+        self._write(OP_ADD, payload)
+        self.pending_records += 1
+
+    def append_clear(self):
+        """Log that all documents were removed"""
+        self._write(OP_CLEAR)
+        self.pending_records += 1
+
+    def commit(self):
+        """Close the current batch and force it to disk"""
+        if self._file is None or self.pending_records == 0:
+            return
+        self._write(OP_COMMIT)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.pending_records = 0
+
+    def rotate(self) -> int:
+        """Commit and switch to a new segment; returns the new segment number"""
+        self.commit()
+        self._open_segment(self.segment + 1)
+        return self.segment
+
+    def remove_segments_before(self, segment: int):
+        """Delete segments already folded into a snapshot"""
+        for existing in self.segments():
+            if existing < segment:
+                os.remove(self._segment_path(existing))
+
+    def close(self):
+        if self._file is not None:
+            self.commit()
+            self._file.close()
+            self._file = None
+
+    def _read_segment(self, segment: int):
+        """Yield (op, payload) records until the end of the file or the first damaged record"""
+        with open(self._segment_path(segment), "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    if header:
+                        logger.warning(f"Torn record header at end of WAL segment {segment}")
+                    return
+                op, length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    logger.warning(f"Damaged record in WAL segment {segment}, ignoring the rest of it")
+                    return
+                yield op, payload
+
+    def replay(self, from_segment: int, apply: Callable[[int, Optional[tuple]], None]) -> int:
+        """Apply committed records from segments >= from_segment; returns the number applied"""
+        applied = 0
+        for segment in self.segments():
+            if segment < from_segment:
+                continue
+            batch = []
+            for op, payload in self._read_segment(segment):
+                if op == OP_COMMIT:
+                    for record in batch:
+                        apply(*record)
+                    applied += len(batch)
+                    batch = []
+                elif op == OP_CLEAR:
+                    batch.append((OP_CLEAR, None))
+                elif op == OP_ADD:
+                    (header_len,) = struct.unpack_from("<I", payload)
+                    doc_id, content, metadata = json.loads(payload[4:4 + header_len].decode("utf-8"))
+                    vector = np.frombuffer(payload, dtype=np.float32, offset=4 + header_len)
+                    batch.append((OP_ADD, (doc_id, content, metadata, vector)))
+            if batch:
+                logger.warning(f"Discarded {len(batch)} uncommitted WAL records from segment {segment}")
+        return applied